@@ -0,0 +1,82 @@
+"""
+Runs evolution in a separate process, so the render loop stays responsive while whole generations are evaluated.
+The evolution is a generator function yielding snapshots, which reach the render loop through a queue.
+"""
+import multiprocessing
+import queue
+import signal
+
+def _exit(signum, frame):
+    raise SystemExit(1)
+
+def _run(snapshots_fn, args, snapshots, stop):
+    # Let close() terminate the process through the finally blocks of the evolution, which stop its own workers
+    signal.signal(signal.SIGTERM, _exit)
+    generator = snapshots_fn(*args)
+    try:
+        for snapshot in generator:
+            # Wait for the render loop to make room, but give up once asked to stop
+            while not stop.is_set():
+                try:
+                    snapshots.put(snapshot, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+    finally:
+        generator.close()
+
+class BackgroundEvolution:
+    def __init__(self, snapshots_fn, *args, max_pending=2):
+        """
+        Starts snapshots_fn(*args) in a new process.
+
+        Parameters
+        ----------
+        snapshots_fn : Callable
+            A picklable generator function, every yielded snapshot is sent to the render loop.
+            A snapshot must be picklable and must not be changed by the generator after it was yielded.
+        max_pending : int
+            The number of snapshots waiting for the render loop, before the evolution waits as well.
+        """
+        self.snapshot = None
+        self._snapshots = multiprocessing.Queue(maxsize=max_pending)
+        self._stop = multiprocessing.Event()
+        # Not a daemon, the evolution may use a process pool of its own
+        self._process = multiprocessing.Process(
+            target=_run,
+            args=(snapshots_fn, args, self._snapshots, self._stop)
+        )
+        self._process.start()
+
+    def poll(self):
+        """
+        Returns the newest snapshot if one arrived since the last call, otherwise None.
+        The newest snapshot is also kept in self.snapshot, older ones are skipped.
+        """
+        newest = None
+        while True:
+            try:
+                newest = self._snapshots.get_nowait()
+            except queue.Empty:
+                break
+        if newest is not None:
+            self.snapshot = newest
+        return newest
+
+    def close(self, timeout=5):
+        """
+        Stops the evolution after its current generation, or terminates it after timeout seconds.
+        Termination raises SystemExit in the evolution, so it can still clean up.
+        """
+        self._stop.set()
+        waited = 0
+        while self._process.is_alive() and waited < timeout:
+            # Keep draining, a process with queued data does not exit
+            self.poll()
+            self._process.join(0.1)
+            waited += 0.1
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
@@ -0,0 +1,221 @@
+"""
+Throughput benchmarks of car construction, fights, car generations and selection, with fixed seeds.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --tolerance 0.15
+    python benchmark.py --quick --only fight
+
+Results are written as JSON, every benchmark reports a rate in its unit per second.
+The all_vs_n benchmarks run the same fights with growing process pools and also report their speedup over one worker.
+With --baseline every rate is compared against a previous result file and the exit code is 1 if a benchmark
+got slower by more than the tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+from Box2D import b2World
+
+from genomes import CarGenome, FighterGenome
+from population import Population, RankedPopulation, ArrayPopulation
+from genome_arrays import CarGenomeArrays
+from car_evolution import CarEvolver
+from fighter_evolution import FighterEvolver
+
+SEED = 1
+
+def seed_everything(seed=SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+
+def measure(setup, repeat):
+    """
+    Times a benchmark repeat times and returns (operations, seconds) of the fastest run.
+    setup prepares a run untimed and returns it, or a (run, teardown) pair. The run returns the number of operations it did.
+    """
+    best = None
+    for _ in range(repeat):
+        seed_everything()
+        run = setup()
+        teardown = None
+        if isinstance(run, tuple):
+            run, teardown = run
+        start = time.perf_counter()
+        count = run()
+        seconds = time.perf_counter() - start
+        if teardown is not None:
+            teardown()
+        if best is None or seconds < best[1]:
+            best = (count, seconds)
+    return best
+
+def bench_create_car(genome_class, num_cars):
+    def setup():
+        genomes = [genome_class(body_vertices=10) for _ in range(num_cars)]
+        world = b2World(gravity=(0, 9.71))
+        def run():
+            for genome in genomes:
+                genome.create_car(world, (0, 0))
+            return num_cars
+        return run
+    return setup
+
+def bench_fights(num_fights):
+    def setup():
+        evolver = FighterEvolver(10, 20)
+        matchups = [evolver.get_random_matchup() for _ in range(num_fights)]
+        def run():
+            for genome_left, genome_right in matchups:
+                evolver.evaluate_matchup(genome_left, genome_right)
+            return num_fights
+        return run
+    return setup
+
+def bench_car_generation(population_size, cars_per_world=1):
+    def setup():
+        population = ArrayPopulation(population_size, lambda n: CarGenomeArrays(n, body_vertices=10))
+        # Otherwise the defaults, the first generation never hits the fitness cache
+        evolver = CarEvolver(population, cars_per_world=cars_per_world)
+        def run():
+            evolver.evaluate_genomes()
+            return population_size
+        return run
+    return setup
+
+def bench_selection(population_class, population_size, num_rounds):
+    def setup():
+        if population_class is ArrayPopulation:
+            population = ArrayPopulation(population_size, lambda n: CarGenomeArrays(n, body_vertices=10))
+            population.arrays.fitness[:] = np.random.uniform(0, 100, size=population_size)
+        else:
+            population = population_class(population_size, lambda: CarGenome(body_vertices=10))
+            for genome in population.genomes:
+                genome.fitness = np.random.uniform(0, 100)
+            population.genomes = population.genomes
+        num_elites = population_size // 5
+        def run():
+            for _ in range(num_rounds):
+                population.elite_select(num_elites)
+                population.roulette_wheel_crossover(population_size - num_elites)
+            return num_rounds
+        return run
+    return setup
+
+def bench_all_vs_n(n, population_size, num_workers):
+    def setup():
+        evolver = FighterEvolver(10, population_size, num_workers=num_workers)
+        if num_workers > 1:
+            # Starting the workers is not part of the measurement
+            evolver._get_pool()
+        def run():
+            evolver.evaluate_all_vs_n(n=n)
+            return population_size * n
+        return run, evolver.close
+    return setup
+
+def worker_counts():
+    return sorted({1, 2, 4, multiprocessing.cpu_count()})
+
+def benchmarks(quick=False):
+    """
+    Returns a list of (name, unit, setup, repeat).
+    """
+    sizes = [100, 1000] if quick else [100, 1000, 10000]
+    suite = [
+        ("create_car/car", "cars", bench_create_car(CarGenome, 500), 5),
+        ("create_car/fighter", "cars", bench_create_car(FighterGenome, 500), 5),
+        ("fight/evaluate_matchup", "fights", bench_fights(20 if quick else 50), 1),
+        ("car_generation/100", "genomes", bench_car_generation(100), 1),
+        ("car_generation/shared_10/100", "genomes", bench_car_generation(100, cars_per_world=10), 1),
+    ]
+    if not quick:
+        suite.append(("car_generation/1000", "genomes", bench_car_generation(1000), 1))
+        suite.append(("car_generation/shared_10/1000", "genomes", bench_car_generation(1000, cars_per_world=10), 1))
+    for population_class in (Population, RankedPopulation, ArrayPopulation):
+        for size in sizes:
+            suite.append((f"selection/{population_class.__name__}/{size}", "rounds",
+                          bench_selection(population_class, size, max(1, 20000 // size)), 5))
+    for num_workers in worker_counts():
+        suite.append((f"all_vs_n/workers_{num_workers}", "fights",
+                      bench_all_vs_n(1 if quick else 2, 40, num_workers), 1))
+    return suite
+
+def add_speedups(results):
+    """
+    Adds the speedup over one worker to the results of the all_vs_n benchmarks.
+    """
+    reference = results.get("all_vs_n/workers_1")
+    if reference is None:
+        return
+    for name, result in results.items():
+        if name.startswith("all_vs_n/"):
+            result["speedup"] = result["rate"] / reference["rate"]
+            print(f"{name:40s} {result['speedup']:12.2f} x", file=sys.stderr)
+
+def run_benchmarks(quick=False, only=None):
+    results = {}
+    for name, unit, setup, repeat in benchmarks(quick):
+        if only is not None and not any(name.startswith(prefix) for prefix in only):
+            continue
+        count, seconds = measure(setup, repeat)
+        results[name] = {"unit": unit, "count": count, "seconds": seconds, "rate": count / seconds}
+        print(f"{name:40s} {count / seconds:12.1f} {unit}/s", file=sys.stderr, flush=True)
+    add_speedups(results)
+    return {
+        "seed": SEED,
+        "quick": quick,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the names of benchmarks whose rate dropped by more than tolerance compared to the baseline.
+    """
+    slower = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        change = result["rate"] / reference["rate"] - 1
+        marker = ""
+        if change < -tolerance:
+            slower.append(name)
+            marker = "  SLOWER"
+        print(f"{name:40s} {change:+8.1%}{marker}", file=sys.stderr)
+    return slower
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure simulation and evolution throughput.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument("--baseline", default=None, help="Compare against the results of a previous run.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against the baseline.")
+    parser.add_argument("--quick", action="store_true", help="Skip the largest sizes.")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run benchmarks whose name starts with these.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args.quick, args.only)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
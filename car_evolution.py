@@ -0,0 +1,350 @@
+import functools
+import hashlib
+import math
+import numpy as np
+import random
+
+from collections import OrderedDict
+
+from population import Population, ArrayPopulation
+from physics import PhysicsSettings, WorldRunner, CAR_PHYSICS
+from instrumentation import NULL_PROFILER
+from Box2D import b2World, b2FixtureDef, b2PolygonShape, b2Vec2
+
+FLOOR_TILE_DIM = (4, 0.5)
+FLOOR_START = (0, 24)
+
+@functools.lru_cache(maxsize=16)
+def floor_geometry(num_floor_tiles=100, seed=1):
+    """
+    Returns the tile positions with shape (num_floor_tiles, 2) and the tile vertices relative to them
+    with shape (num_floor_tiles, 4, 2). The arrays are cached per seed and read only.
+    """
+    generator = np.random.default_rng(seed)
+    xdim, ydim = FLOOR_TILE_DIM
+    # One draw per tile in tile order, the same stream as drawing them one by one
+    angles = (generator.random(num_floor_tiles) * 3 - 1.5) * 1.5 * np.arange(num_floor_tiles) / num_floor_tiles
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    corners = np.array([(0, 0), (0, -ydim), (xdim, -ydim), (xdim, 0)], dtype=float)
+    vertices = np.stack([cos * corners[:, 0] - sin * corners[:, 1],
+                         sin * corners[:, 0] + cos * corners[:, 1]], axis=-1)
+    # Every tile starts where the previous one ended
+    positions = np.empty((num_floor_tiles, 2))
+    positions[0] = FLOOR_START
+    positions[1:] = FLOOR_START + np.cumsum(vertices[:-1, 3], axis=0)
+    positions.flags.writeable = False
+    vertices.flags.writeable = False
+    return positions, vertices
+
+def floor_polygons(num_floor_tiles=100, seed=1):
+    """
+    Returns the world vertices of every floor tile, with shape (num_floor_tiles, 4, 2).
+    """
+    positions, vertices = floor_geometry(num_floor_tiles, seed)
+    return positions[:, None] + vertices
+
+def create_floor_tile(world, position, vertices):
+    return world.CreateStaticBody(
+        position=b2Vec2(*position),
+        fixtures=b2FixtureDef(shape=b2PolygonShape(vertices=vertices.tolist()), friction=1),
+    )
+
+def create_floor(world, num_floor_tiles=100, seed=1, edges=False):
+    """
+    Adds the floor to the world and returns its static bodies.
+    By default every tile is a body with one polygon, with edges the floor is a single body
+    made of the top edge of every tile.
+    """
+    positions, vertices = floor_geometry(num_floor_tiles, seed)
+    if not edges:
+        return [create_floor_tile(world, position, tile) for position, tile in zip(positions, vertices)]
+
+    body = world.CreateStaticBody()
+    for start, end in (positions[:, None] + vertices[:, 1:3]).tolist():
+        body.CreateEdgeFixture(vertices=[start, end], friction=1)
+    return [body]
+
+
+def generate_next_generation(population: Population):
+    if isinstance(population, ArrayPopulation):
+        population.next_generation()
+        return
+
+    elites = population.elite_select(int(len(population) * 0.2))
+    children = population.roulette_wheel_crossover(len(population) - len(elites))
+    for child in children:
+        child.mutate()
+    population.genomes = [*elites, *children]
+    random.shuffle(population.genomes)
+
+
+class FitnessCache:
+    """
+    Least recently used cache of fitness values, keyed by a hash of the genome parameters and the evaluation settings.
+    This assumes the same genome and settings always reach the same fitness, which only holds for a car alone in its world.
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def key(self, genome, settings):
+        digest = hashlib.blake2b(repr(settings).encode(), digest_size=16)
+        for name, value in sorted(genome.get_parameters().items()):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        return digest.digest()
+
+    def get(self, key):
+        fitness = self._entries.get(key)
+        if fitness is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return fitness
+
+    def put(self, key, fitness):
+        self._entries[key] = fitness
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CarEvolver:
+    def __init__(self, population: Population, num_iterations=1000, cars_per_world=1,
+                 stall_window=100, min_progress=0.5, floor_seed=1, edge_floor=False, fitness_cache_size=4096,
+                 physics: PhysicsSettings = CAR_PHYSICS, profiler=NULL_PROFILER):
+        """
+        Evolves cars driving along the floor, the fitness of a car is how far it got.
+
+        Parameters
+        ----------
+        population : Population
+            The population of car genomes, can also be an ArrayPopulation.
+        num_iterations : int
+            The maximum number of physics steps used to evaluate a generation.
+        cars_per_world : int
+            Cars sharing a world also share its floor, collision filtering keeps them from touching each other.
+            They still share the broadphase and the contact order of the world, so the fitness of a car then depends
+            on which genomes share its world. It is noisy and not reproducible per genome, 1 keeps it exact.
+        stall_window : int
+            A car is retired once it fell asleep or did not get min_progress further within stall_window steps.
+            None always simulates num_iterations steps.
+        min_progress : float
+            See stall_window.
+        floor_seed : int
+            The seed of the generated floor.
+        edge_floor : bool
+            Builds the floor as one body of edges instead of a body per tile, see create_floor.
+        fitness_cache_size : int
+            The number of fitness values remembered for genomes that were already evaluated on the same floor.
+            Elites are then not simulated again, None disables the cache.
+            The cache is only used with one car per world, shared worlds do not give the same genome the same fitness.
+        physics : PhysicsSettings
+            How the worlds are stepped. With a screening preset every genome is first evaluated with the coarse settings
+            and only the best physics.rescore_fraction of the population is simulated again at full fidelity.
+        profiler : Profiler
+            Times building, physics and selection and counts steps and genomes, see instrumentation.py.
+        """
+        self.population = population
+        self.num_iterations = num_iterations
+        self.cars_per_world = cars_per_world
+        self.stall_window = stall_window
+        self.min_progress = min_progress
+        self.floor_seed = floor_seed
+        self.edge_floor = edge_floor
+        self.physics = physics
+        self.profiler = profiler
+        # A cached fitness has to be what a new simulation would give
+        self.fitness_cache = FitnessCache(fitness_cache_size) if fitness_cache_size and cars_per_world == 1 else None
+        self.epochs = 0
+        self.initialize_worlds()
+
+    def initialize_worlds(self, genomes=None):
+        """
+        Creates the worlds and cars for the given genomes, by default for the whole population.
+        """
+        self.genomes = list(self.population.genomes if genomes is None else genomes)
+        self.worlds = []
+        self.cars = []
+        with self.profiler.phase("build"):
+            for i, genome in enumerate(self.genomes):
+                if i % self.cars_per_world == 0:
+                    world = b2World(gravity=(0, 9.71), doSleep=True)
+                    # Add a floor
+                    self.tiles = create_floor(world, seed=self.floor_seed, edges=self.edge_floor)
+                    self.worlds.append(world)
+                # Add a car
+                collision_group = i % self.cars_per_world + 1 if self.cars_per_world > 1 else 0
+                car = genome.create_car(world, (5,19), collision_group=collision_group,
+                                        merge_fixtures=self.physics.merge_body_fixtures)
+                self.cars.append(car)
+
+        self.retired = [False] * len(self.cars)
+        self.best_positions = [car.body.position.x for car in self.cars]
+        self.last_progress_steps = [0] * len(self.cars)
+
+    def generate_next_generation(self):
+        with self.profiler.phase("selection"):
+            generate_next_generation(self.population)
+        self.epochs += 1
+
+    def update_world(self, physics=None):
+        physics = physics or self.physics
+        with self.profiler.phase("physics"):
+            for car, retired in zip(self.cars, self.retired):
+                if not retired:
+                    car.update()
+            for i, world in enumerate(self.worlds):
+                world_retired = self.retired[i * self.cars_per_world:(i + 1) * self.cars_per_world]
+                if not all(world_retired):
+                    physics.step(world)
+                    self.profiler.count("steps")
+
+    def retire_finished_cars(self, step, track_progress=True):
+        """
+        track_progress=False only retires, when the progress up to step was already tracked.
+        """
+        if self.stall_window is None:
+            return
+
+        for i, car in enumerate(self.cars):
+            if self.retired[i]:
+                continue
+
+            if track_progress and car.body.position.x > self.best_positions[i] + self.min_progress:
+                self.best_positions[i] = car.body.position.x
+                self.last_progress_steps[i] = step
+            elif not car.body.awake or step - self.last_progress_steps[i] >= self.stall_window:
+                # Freeze the car where it is, it no longer takes part in the simulation
+                self.retired[i] = True
+                car.body.active = False
+                for wheel in car.wheels:
+                    wheel.active = False
+
+    def update_fitness(self):
+        for car, genome in zip(self.cars, self.genomes):
+            genome.fitness = car.position.x
+
+    def evaluate_genomes(self):
+        self.profiler.count("genomes", len(self.population.genomes))
+        keys, genomes = self._lookup_fitness(self.population.genomes, self.physics)
+        screening = self.physics.screening
+        if screening is not None and genomes:
+            screening_keys, screened_genomes = self._lookup_fitness(genomes, screening)
+            self._simulate(screened_genomes, screening)
+            self._store_fitness(screening_keys, screened_genomes)
+
+            # Only the promising genomes are simulated again at full fidelity
+            num_rescored = math.ceil(len(self.population.genomes) * self.physics.rescore_fraction)
+            ranked = sorted(self.population.genomes, key=lambda x: x.fitness, reverse=True)
+            promising = {id(genome) for genome in ranked[:num_rescored]}
+            genomes = [genome for genome in genomes if id(genome) in promising]
+
+        self._simulate(genomes, self.physics)
+        self._store_fitness(keys, genomes)
+
+    def _simulate(self, genomes, physics):
+        """
+        Evaluates the genomes like calling update_world and retire_finished_cars every step, but runs the worlds
+        for as many steps at once as no car can be retired for a stall.
+        A sleeping car is only retired at the end of such a run, it does not move in the meantime.
+        """
+        self.initialize_worlds(genomes)
+        runners = [WorldRunner(world, self.cars[i * self.cars_per_world:(i + 1) * self.cars_per_world], physics)
+                   for i, world in enumerate(self.worlds)]
+        step = 0
+        while step < self.num_iterations and not all(self.retired):
+            num_steps = self.num_iterations - step
+            if self.stall_window is not None:
+                num_steps = min(num_steps, *(self.stall_window - (step - self.last_progress_steps[i])
+                                             for i, retired in enumerate(self.retired) if not retired))
+            with self.profiler.phase("physics"):
+                for w, runner in enumerate(runners):
+                    first = w * self.cars_per_world
+                    active = [i for i in range(len(runner.cars)) if not self.retired[first + i]]
+                    if not active:
+                        continue
+                    sampled = active if self.stall_window is not None else ()
+                    positions = runner.run(num_steps, sampled)
+                    self.profiler.count("steps", num_steps)
+                    for i, xs in zip(sampled, positions.T.tolist()):
+                        self._track_progress(first + i, xs, step)
+            step += num_steps
+            self.retire_finished_cars(step, track_progress=False)
+        self.update_fitness()
+
+    def _track_progress(self, i, xs, step):
+        # xs are the positions of car i after the steps following step
+        best = self.best_positions[i]
+        for j, x in enumerate(xs):
+            if x > best + self.min_progress:
+                best = x
+                self.last_progress_steps[i] = step + j + 1
+        self.best_positions[i] = best
+
+    def _lookup_fitness(self, genomes, physics):
+        """
+        Sets the fitness of all cached genomes, returns the cache keys and the genomes that still need a simulation.
+        """
+        if self.fitness_cache is None:
+            return None, list(genomes)
+
+        settings = self._evaluation_settings(physics)
+        keys = {id(genome): self.fitness_cache.key(genome, settings) for genome in genomes}
+        uncached_genomes = []
+        for genome in genomes:
+            fitness = self.fitness_cache.get(keys[id(genome)])
+            if fitness is None:
+                uncached_genomes.append(genome)
+            else:
+                genome.fitness = fitness
+        return keys, uncached_genomes
+
+    def _store_fitness(self, keys, genomes):
+        if self.fitness_cache is None:
+            return
+        for genome in genomes:
+            self.fitness_cache.put(keys[id(genome)], genome.fitness)
+
+    def _evaluation_settings(self, physics):
+        # Everything besides the genome that influences the fitness
+        return (self.num_iterations, self.floor_seed, self.edge_floor, physics.key(),
+                self.cars_per_world, self.stall_window, self.min_progress)
+
+    def evolve(self):
+        """
+        Evaluates the current generation and replaces it by the next one.
+        Returns the fitness values of the evaluated generation.
+        """
+        self.evaluate_genomes()
+        fitness = np.array([genome.fitness for genome in self.population.genomes])
+        self.generate_next_generation()
+        return fitness
+
+def copy_evaluated_genomes(genomes):
+    """
+    Returns independent copies of the genomes sorted by descending fitness, keeping their fitness.
+    """
+    copies = []
+    for genome in sorted(genomes, key=lambda x: x.fitness, reverse=True):
+        copy = genome.clone()
+        copy.fitness = float(genome.fitness)
+        copies.append(copy)
+    return copies
+
+def car_evolution_snapshots(population: Population, evolver_kwargs):
+    """
+    Evolves the population forever, for use with background.BackgroundEvolution.
+    Yields (epochs, genomes) after every evaluated generation, the genomes are copies sorted by descending fitness.
+    """
+    evolver = CarEvolver(population, **evolver_kwargs)
+    while True:
+        evolver.evaluate_genomes()
+        yield evolver.epochs, copy_evaluated_genomes(population.genomes)
+        evolver.generate_next_generation()
@@ -0,0 +1,228 @@
+"""
+Compact .npz checkpoints of car and fighter evolution.
+All genomes of a population are stacked into one array per genome field, together with the fitness,
+the TrueSkill ratings and result bookkeeping of fighters and the state of both random number generators.
+"""
+import os
+import queue
+import random
+import threading
+import numpy as np
+
+from collections import deque
+from trueskill import Rating
+
+from genomes import CarGenome, FighterGenome
+from population import ArrayPopulation
+from rating import RatingIndex
+
+GENOME_CLASSES = {
+    "CarGenome": CarGenome,
+    "FighterGenome": FighterGenome,
+}
+
+class CheckpointWriter:
+    """
+    Writes checkpoints from a background thread, so the evolution loop only pays for taking the snapshot.
+    If writing fails, the error is raised by the next write or by close and no further checkpoints are written.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, name, checkpoint):
+        self._raise_error()
+        path = os.path.join(self.directory, name)
+        self._queue.put((path, checkpoint))
+        return path
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                save_checkpoint(*job)
+            except Exception as error:
+                self._error = error
+                return
+
+def save_checkpoint(path, checkpoint):
+    # Write to a temporary file first, so a crash never leaves a half written checkpoint behind
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        np.savez_compressed(f, **checkpoint)
+    os.replace(temporary_path, path)
+
+def load_checkpoint(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def car_checkpoint(evolver):
+    """
+    Returns a snapshot of a CarEvolver, taken after evaluating a generation and before selecting the next one.
+    Every stored fitness then belongs to its genome, restore_car_checkpoint does the selection.
+    The fitness cache is not stored. Resuming is still exact, because the cache only holds values a new simulation
+    gives again, which is why CarEvolver only caches with one car per world.
+    """
+    checkpoint = {
+        "kind": np.array("car"),
+        "epochs": np.array(evolver.epochs),
+    }
+    checkpoint.update(_stack_genomes(evolver.population.genomes, "population_"))
+    checkpoint.update(_random_state())
+    return checkpoint
+
+def restore_car_checkpoint(evolver, checkpoint):
+    """
+    Restores the evaluated generation of a car_checkpoint and selects the next generation from it.
+    """
+    _restore_population(evolver.population, checkpoint, "population_")
+    evolver.epochs = int(checkpoint["epochs"])
+    _set_random_state(checkpoint)
+    evolver.generate_next_generation()
+    evolver.initialize_worlds()
+
+def fighter_checkpoint(evolver, generation=0):
+    """
+    Returns a snapshot of a FighterEvolver including ratings, recent results and win/loss counters.
+    """
+    checkpoint = {
+        "kind": np.array("fighter"),
+        "steps": np.array(evolver.steps),
+        "generation": np.array(generation),
+    }
+    for prefix, population, ratings in [("left_", evolver.population_left, evolver.ratings_left),
+                                        ("right_", evolver.population_right, evolver.ratings_right)]:
+        # Genomes are stored in rating index order, the population order is stored as a permutation
+        genomes = ratings.genomes
+        slots = {id(genome): slot for slot, genome in enumerate(genomes)}
+        checkpoint[prefix + "order"] = np.array([slots[id(genome)] for genome in population.genomes])
+        checkpoint.update(_stack_genomes(genomes, prefix))
+        checkpoint.update(_stack_bookkeeping(genomes, prefix))
+    checkpoint.update(_random_state())
+    return checkpoint
+
+def restore_fighter_checkpoint(evolver, checkpoint):
+    """
+    Restores a FighterEvolver from a fighter_checkpoint, returns the stored generation.
+    """
+    evolver.ratings_left = _restore_fighters(evolver.population_left, checkpoint, "left_")
+    evolver.ratings_right = _restore_fighters(evolver.population_right, checkpoint, "right_")
+    evolver.steps = int(checkpoint["steps"])
+    _set_random_state(checkpoint)
+    return int(checkpoint["generation"])
+
+def load_genomes(path):
+    """
+    Loads the genomes of a checkpoint sorted by descending fitness, as a list of (name, genomes) pairs.
+    """
+    checkpoint = load_checkpoint(path)
+    prefixes = ["population_"] if str(checkpoint["kind"]) == "car" else ["left_", "right_"]
+    populations = []
+    for prefix in prefixes:
+        genomes = _unstack_genomes(checkpoint, prefix)
+        populations.append((prefix[:-1], sorted(genomes, key=lambda x: x.fitness, reverse=True)))
+    return populations
+
+def _stack_genomes(genomes, prefix):
+    parameters = [genome.get_parameters() for genome in genomes]
+    genome_class = "FighterGenome" if isinstance(genomes[0], FighterGenome) else "CarGenome"
+    stacked = {prefix + key: np.array([p[key] for p in parameters]) for key in parameters[0]}
+    stacked[prefix + "fitness"] = np.array([genome.fitness for genome in genomes], dtype=float)
+    stacked[prefix + "genome_class"] = np.array(genome_class)
+    stacked[prefix + "parameters"] = np.array(list(parameters[0]))
+    return stacked
+
+def _unstack_genomes(checkpoint, prefix):
+    genome_class = GENOME_CLASSES[str(checkpoint[prefix + "genome_class"])]
+    fields = [str(field) for field in checkpoint[prefix + "parameters"]]
+    genomes = []
+    for i, fitness in enumerate(checkpoint[prefix + "fitness"]):
+        genome = genome_class.from_parameters({field: checkpoint[prefix + field][i].copy() for field in fields})
+        genome.fitness = fitness.item()
+        genomes.append(genome)
+    return genomes
+
+def _restore_population(population, checkpoint, prefix):
+    if isinstance(population, ArrayPopulation):
+        arrays = population.arrays.__class__.__new__(population.arrays.__class__)
+        for field in arrays.FIELDS:
+            setattr(arrays, field, checkpoint[prefix + field].copy())
+        population._set_arrays(arrays)
+    else:
+        population.genomes = _unstack_genomes(checkpoint, prefix)
+
+def _restore_fighters(population, checkpoint, prefix):
+    genomes = _unstack_genomes(checkpoint, prefix)
+    _restore_bookkeeping(genomes, checkpoint, prefix)
+    population.genomes = [genomes[slot] for slot in checkpoint[prefix + "order"]]
+    return RatingIndex(genomes)
+
+def _stack_bookkeeping(genomes, prefix):
+    maxlen = genomes[0].last_results.maxlen
+    last_results = np.full((len(genomes), maxlen), np.nan)
+    for i, genome in enumerate(genomes):
+        last_results[i, :len(genome.last_results)] = genome.last_results
+    return {
+        prefix + "mu": np.array([genome.rating.mu for genome in genomes]),
+        prefix + "sigma": np.array([genome.rating.sigma for genome in genomes]),
+        prefix + "last_results": last_results,
+        prefix + "num_results": np.array([len(genome.last_results) for genome in genomes]),
+        prefix + "wins": np.array([genome.wins for genome in genomes]),
+        prefix + "losses": np.array([genome.losses for genome in genomes]),
+        prefix + "draws": np.array([genome.draws for genome in genomes]),
+        prefix + "steps": np.array([genome.steps for genome in genomes]),
+    }
+
+def _restore_bookkeeping(genomes, checkpoint, prefix):
+    last_results = checkpoint[prefix + "last_results"]
+    for i, genome in enumerate(genomes):
+        genome.rating = Rating(checkpoint[prefix + "mu"][i].item(), checkpoint[prefix + "sigma"][i].item())
+        num_results = checkpoint[prefix + "num_results"][i]
+        genome.last_results = deque(last_results[i, :num_results].tolist(), maxlen=last_results.shape[1])
+        genome.wins = int(checkpoint[prefix + "wins"][i])
+        genome.losses = int(checkpoint[prefix + "losses"][i])
+        genome.draws = int(checkpoint[prefix + "draws"][i])
+        genome.steps = int(checkpoint[prefix + "steps"][i])
+
+def _random_state():
+    _, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    version, python_state, python_gauss = random.getstate()
+    return {
+        "numpy_random_keys": keys,
+        "numpy_random_position": np.array(position),
+        "numpy_random_has_gauss": np.array(has_gauss),
+        "numpy_random_cached_gaussian": np.array(cached_gaussian),
+        "python_random_version": np.array(version),
+        "python_random_state": np.array(python_state, dtype=np.uint64),
+        "python_random_gauss": np.array(np.nan if python_gauss is None else python_gauss),
+    }
+
+def _set_random_state(checkpoint):
+    np.random.set_state((
+        "MT19937",
+        checkpoint["numpy_random_keys"],
+        int(checkpoint["numpy_random_position"]),
+        int(checkpoint["numpy_random_has_gauss"]),
+        float(checkpoint["numpy_random_cached_gaussian"]),
+    ))
+    python_gauss = float(checkpoint["python_random_gauss"])
+    random.setstate((
+        int(checkpoint["python_random_version"]),
+        tuple(int(x) for x in checkpoint["python_random_state"]),
+        None if np.isnan(python_gauss) else python_gauss,
+    ))
@@ -1,84 +1,70 @@
+import functools
 import pygame
-import math
-import numpy as np
-import random
 
-from genomes import CarGenome
-from population import Population
+from population import Population, ArrayPopulation
+from genome_arrays import CarGenomeArrays
+from car_evolution import CarEvolver, floor_polygons, car_evolution_snapshots
+from background import BackgroundEvolution
 from constants import PPM
-from game_base import GameBase
-from Box2D import b2World, b2PolygonShape, b2BodyDef, b2Vec2, b2FixtureDef
+from physics import CAR_PHYSICS
+from instrumentation import NULL_PROFILER
+from game_base import GameBase, StaticLayer
+from rendering import render_car
 from pygame import Vector2
 
-from typing import List
-
-def create_floor_tile(world, dim, position, angle):
-    xdim, ydim = dim
-    vertices = [b2Vec2(0, 0), b2Vec2(0, -ydim), b2Vec2(xdim, -ydim), b2Vec2(xdim, 0)]
-    center = b2Vec2(0, 0)
-    for i, v in enumerate(vertices):
-        x = math.cos(angle) * (vertices[i].x - center.x) - math.sin(angle) * (vertices[i].y - center.y) + center.x
-        y = math.sin(angle) * (vertices[i].x - center.x) + math.cos(angle) * (vertices[i].y - center.y) + center.y
-        vertices[i] = b2Vec2(x,y)
-
-    body = world.CreateStaticBody(
-        position=position,
-        shapes=b2PolygonShape(vertices=vertices),
-    )
-    body.CreatePolygonFixture(vertices=vertices, friction=1)
-
-    return vertices[3] + position, body
-
-def create_floor(world, num_floor_tiles=100, seed=1):
-    generator = np.random.default_rng(seed)
-    dim = Vector2(4, 0.5)
-    tiles = []
-    next_position = Vector2(0,24)
-    for i in range(num_floor_tiles):
-        angle = (generator.random() * 3 - 1.5) * 1.5 * i / num_floor_tiles
-        next_position, tile = create_floor_tile(world, dim, next_position, angle)
-        tiles.append(tile)
-    return tiles
-
-
-def generate_next_generation(population: Population):
-    elites = population.elite_select(int(len(population) * 0.2))
-    children = population.roulette_wheel_crossover(len(population) - len(elites))
-    for child in children:
-        child.mutate()
-    population.genomes = [*elites, *children]
-    random.shuffle(population.genomes)
-
+TILE_MARKER_COLORS = [pygame.Color("RED"), pygame.Color("YELLOW"), pygame.Color("GREEN"), pygame.Color("PURPLE")]
+
+def static_body_polygons(bodies):
+    """
+    Returns the world vertices of the first polygon of every body.
+    """
+    return [[body.transform * v for v in body.fixtures[0].shape.vertices] for body in bodies]
+
+def create_ground_layer(polygons, color, show_tile_corners=False):
+    """
+    Rasterizes floor polygons given in world meters into a StaticLayer, optionally marking the corners of each tile.
+    """
+    layer = StaticLayer()
+    for polygon in polygons:
+        vertices = [Vector2(*v) * PPM for v in polygon]
+        layer.add_polygon(color, vertices)
+        if show_tile_corners:
+            for marker_color, v in zip(TILE_MARKER_COLORS, vertices):
+                layer.add_circle(marker_color, v, 2)
+    return layer
 
 class CarEvolutionRenderer(GameBase):
     GROUND_COLOR = pygame.Color("#808080")
     
     def __init__(self, screen_width, screen_height, population: Population,
-                 fps=60, num_iterations=1000):
+                 fps=60, num_iterations=1000, cars_per_world=1,
+                 stall_window=100, min_progress=0.5, physics=CAR_PHYSICS, profiler=NULL_PROFILER,
+                 background=False):
+        """
+        If background is set, the evolution runs in another process and the window replays the newest evaluated
+        generation it sent, otherwise every replay is followed by a few generations evolved in the render loop.
+        The population then has to be picklable.
+        """
         super().__init__('Car Evolution', screen_width, screen_height, fps=fps)
-        self.population = population
-        self.initialize_worlds()
+        self.evolver = CarEvolver(population, num_iterations=num_iterations, cars_per_world=cars_per_world,
+                                  stall_window=stall_window, min_progress=min_progress, physics=physics,
+                                  profiler=profiler)
+        self.profiler = profiler
+        self.background = None
+        if background:
+            evolver_kwargs = dict(num_iterations=num_iterations, cars_per_world=cars_per_world,
+                                  stall_window=stall_window, min_progress=min_progress, physics=physics)
+            self.background = BackgroundEvolution(car_evolution_snapshots, population, evolver_kwargs)
         self.num_steps = 0
-        self.epochs = 0
-        self.num_iterations = num_iterations
+        # The floor is the same in every world and generation
+        self.ground_layer = create_ground_layer(floor_polygons(seed=self.evolver.floor_seed),
+                                                CarEvolutionRenderer.GROUND_COLOR,
+                                                show_tile_corners=True)
 
         self.font = pygame.font.SysFont("Arial" , 18 , bold = True)
     
-    def initialize_worlds(self):
-        self.worlds = []
-        self.cars = []
-        for genome in self.population.genomes:
-            world = b2World(gravity=(0, 9.71), doSleep=True)
-            # Add a floor
-            self.tiles = create_floor(world)
-            # Add a car
-            car = genome.create_car(world, (5,19))
-            
-            self.worlds.append(world)
-            self.cars.append(car)
-    
     def _move_camera(self):
-        best_car = max(self.cars, key=lambda x: x.position.x)
+        best_car = max(self.evolver.cars, key=lambda x: x.position.x)
         pos = best_car.position * PPM
         self.camera_pos = Vector2(pos.x - self.screen_width // 2, pos.y - self.screen_height // 2)
         
@@ -91,53 +77,38 @@ class CarEvolutionRenderer(GameBase):
         #if pygame.key.get_pressed()[pygame.K_DOWN]:
         #    self.move_camera(Vector2(0, 100))
 
-    def _generate_next_generation(self):
-        generate_next_generation(self.population)
-
-    def _update_world(self, delta_time):
-        # Called a fixed amount of times each second
-        for car in self.cars:
-            car.update()
-        for world in self.worlds:
-            world.Step(delta_time, 10, 10)
-
-    def _update_fitness(self):
-        for car, genome in zip(self.cars, self.population.genomes):
-            genome.fitness = car.position.x
-
-    def evaluate_genomes(self):
-        self.initialize_worlds()
-
-        for i in range(self.num_iterations):
-            self._update_world(2./60)
-
-        self._update_fitness()
-
     def fixed_step(self, delta_time):
         self._move_camera()
 
         # Update the world
-        self._update_world(delta_time * 2)
+        self.evolver.update_world()
         self.num_steps += 1
+        self.evolver.retire_finished_cars(self.num_steps)
 
         # Update fitness
-        self._update_fitness()
-        if self.num_steps == self.num_iterations:
-            self._generate_next_generation()
-            for i in range(3):
-                self.evaluate_genomes()
-                self._generate_next_generation()
-                self.epochs += 1
-
-            self.initialize_worlds()
-            self.epochs += 1
+        self.evolver.update_fitness()
+        if self.background is not None:
+            self.background.poll()
+        if self.num_steps == self.evolver.num_iterations or all(self.evolver.retired):
+            if self.background is None:
+                self.evolver.generate_next_generation()
+                for i in range(3):
+                    self.evolver.evolve()
+                self.evolver.initialize_worlds()
+            elif self.background.snapshot is not None:
+                # Replay the newest generation evaluated in the background
+                self.evolver.epochs, genomes = self.background.snapshot
+                self.evolver.initialize_worlds(genomes)
+            else:
+                self.evolver.initialize_worlds(self.evolver.genomes)
             self.num_steps = 0
 
     def render_cars(self):
         # Draw the cars from each world, sorted by fitness
-        sorted_cars = list(sorted(self.cars, key=lambda x: x.position.x, reverse=True))
-        for car in [*sorted_cars[:3], *self.cars[:7]]:
-            car.render(self)
+        cars = self.evolver.cars
+        sorted_cars = list(sorted(cars, key=lambda x: x.position.x, reverse=True))
+        for car in [*sorted_cars[:3], *cars[:7]]:
+            render_car(car, self)
 
     def render(self):
         self.render_ground()
@@ -145,15 +116,7 @@ class CarEvolutionRenderer(GameBase):
         self.render_info()
 
     def render_ground(self):
-        # Draw ground from any world
-        for floor_tile in self.tiles:
-            ground_shape = floor_tile.fixtures[0].shape
-            vertices = [(floor_tile.transform * v) * PPM for v in ground_shape.vertices]
-            self.draw_polygon(CarEvolutionRenderer.GROUND_COLOR, vertices)
-            self.draw_circle(pygame.Color("RED"), vertices[0], 2)
-            self.draw_circle(pygame.Color("YELLOW"), vertices[1], 2)
-            self.draw_circle(pygame.Color("GREEN"), vertices[2], 2)
-            self.draw_circle(pygame.Color("PURPLE"), vertices[3], 2)
+        self.ground_layer.render(self)
 
     def render_info(self):
         # Show fps    
@@ -162,21 +125,31 @@ class CarEvolutionRenderer(GameBase):
         self.screen.blit(fps_t,(0,0))
         # Show statistics
         step = self.font.render(f"Steps: {self.num_steps}", 1, pygame.Color("BLUE"))
-        epoch = self.font.render(f"Epoch: {self.epochs}", 1, pygame.Color("BLUE"))
+        epoch = self.font.render(f"Epoch: {self.evolver.epochs}", 1, pygame.Color("BLUE"))
+        speed = self.font.render(self.speed_text(), 1, pygame.Color("BLUE"))
         self.screen.blit(step,(0,18))
         self.screen.blit(epoch,(0,36))
+        self.screen.blit(speed,(0,54))
+        # Show profiling data, if enabled
+        for i, line in enumerate(self.profiler.summary()):
+            text = self.font.render(line, 1, pygame.Color("BLACK"))
+            self.screen.blit(text,(0,72 + 18 * i))
 
     def handle_event(self, event):
         pass
 
+    def close(self):
+        if self.background is not None:
+            self.background.close()
+
 if __name__ == "__main__":
     NUM_VERTICES = 10
     POPULATION_SIZE = 100
 
-    car_population = Population(
+    car_population = ArrayPopulation(
         population_size=POPULATION_SIZE,
-        genome_fn=lambda: CarGenome(body_vertices=NUM_VERTICES,)
+        arrays_fn=functools.partial(CarGenomeArrays, body_vertices=NUM_VERTICES)
     )
-    renderer = CarEvolutionRenderer(640, 640, car_population)
+    renderer = CarEvolutionRenderer(640, 640, car_population, background=True)
 
     renderer.run()
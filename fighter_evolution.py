@@ -0,0 +1,465 @@
+import multiprocessing
+import numpy as np
+
+from collections import deque
+from Box2D import b2World, b2PolygonShape
+from constants import LEFT_MUTATION_RATE, RIGHT_MUTATION_RATE
+from population import RankedPopulation
+from genomes import FighterGenome
+from rating import RatingIndex, TrueSkill1vs1, rate_matches
+from physics import PhysicsSettings, WorldRunner, FIGHTER_PHYSICS
+from instrumentation import NULL_PROFILER
+
+from trueskill import Rating
+
+def create_arena_world():
+    world = b2World(gravity=(0, 9.71), doSleep=True)
+    # Add a floor
+    tiles = [world.CreateStaticBody(
+        position=(0, 24),
+        shapes=b2PolygonShape(box=(50, 1)),
+    )]
+    return world, tiles
+
+def create_arena(genome_left, genome_right, merge_fixtures=False):
+    world, tiles = create_arena_world()
+    # Add a car
+    car_left = genome_left.create_car(world, (-10, 19), merge_fixtures=merge_fixtures)
+    car_right = genome_right.create_car(world, (10, 19), is_flipped=True, merge_fixtures=merge_fixtures)
+    return world, tiles, car_left, car_right
+
+class Arena:
+    """
+    A reusable arena, the world and its floor stay alive between matches and only the two cars are replaced.
+    """
+    def __init__(self):
+        self.world, self.tiles = create_arena_world()
+        self.car_left = None
+        self.car_right = None
+
+    def reset(self, genome_left, genome_right, merge_fixtures=False):
+        self.clear()
+        self.car_left = genome_left.create_car(self.world, (-10, 19), merge_fixtures=merge_fixtures)
+        self.car_right = genome_right.create_car(self.world, (10, 19), is_flipped=True, merge_fixtures=merge_fixtures)
+        return self.car_left, self.car_right
+
+    def clear(self):
+        # Destroying a body also destroys its joints
+        for car in (self.car_left, self.car_right):
+            if car is None:
+                continue
+            for wheel in car.wheels:
+                self.world.DestroyBody(wheel)
+            self.world.DestroyBody(car.body)
+        self.car_left = None
+        self.car_right = None
+
+# Every process, including pool workers, reuses its own arena
+_arena = None
+
+def get_arena():
+    global _arena
+    if _arena is None:
+        _arena = Arena()
+    return _arena
+
+def simulate_matchup(genome_left, genome_right, evaluation_steps, decision_steps=None, reuse_arena=False,
+                     physics=FIGHTER_PHYSICS, profiler=NULL_PROFILER):
+    """
+    Lets two genomes fight without touching any of their evaluation bookkeeping.
+    If decision_steps is given, the fight ends early once the same side has been winning for that many consecutive steps.
+    If reuse_arena is set, the fight takes place in the arena of this process instead of a new world.
+    Returns (fitness_left, fitness_right, left_won, right_won, draw).
+    """
+    with profiler.phase("build"):
+        arena = get_arena() if reuse_arena else Arena()
+        world = arena.world
+        car_left, car_right = arena.reset(genome_left, genome_right, physics.merge_body_fixtures)
+    
+    leading = None
+    leading_steps = 0
+    with profiler.phase("physics"):
+        runner = WorldRunner(world, (car_left, car_right), physics)
+        if decision_steps is None:
+            runner.run(evaluation_steps)
+            profiler.count("steps", evaluation_steps)
+        steps = 0
+        while decision_steps is not None and steps < evaluation_steps and leading_steps < decision_steps:
+            # No side can be decided as winner before it kept its lead for the missing steps
+            num_steps = min(decision_steps - leading_steps, evaluation_steps - steps)
+            positions = runner.run(num_steps, sampled=(0, 1))
+            steps += num_steps
+            profiler.count("steps", num_steps)
+            for x_left, x_right in positions.tolist():
+                left_ahead = x_left > 0
+                right_ahead = x_right < 0
+                if left_ahead == right_ahead:
+                    leading = None
+                    leading_steps = 0
+                elif left_ahead == leading:
+                    leading_steps += 1
+                else:
+                    leading = left_ahead
+                    leading_steps = 1
+    
+    # Push the opponent as far as you can
+    fitness_left = car_right.position.x
+    fitness_right = -car_left.position.x
+    
+    left_won = car_left.position.x > 0
+    right_won = car_right.position.x < 0
+    draw = left_won == right_won
+    if reuse_arena:
+        arena.clear()
+    return fitness_left, fitness_right, left_won, right_won, draw
+
+def _simulate_matchup_worker(job):
+    # Runs inside a pool process, genomes are shipped as plain parameters
+    parameters_left, parameters_right, evaluation_steps, decision_steps, reuse_arena, physics = job
+    return simulate_matchup(
+        FighterGenome.from_parameters(parameters_left),
+        FighterGenome.from_parameters(parameters_right),
+        evaluation_steps,
+        decision_steps,
+        reuse_arena,
+        physics
+    )
+
+def _count_outcomes(outcomes):
+    left_wins = 0
+    right_wins = 0
+    draws = 0
+    for left_won, right_won, draw in outcomes:
+        if left_won:
+            left_wins += 1
+        elif right_won:
+            right_wins += 1
+        elif draw:
+            draws += 1
+    return left_wins, right_wins, draws
+
+def copy_fighter(genome):
+    """
+    Returns an independent copy of a fighter including its rating and result bookkeeping.
+    """
+    copy = genome.clone()
+    copy.fitness = float(genome.fitness)
+    copy.rating = genome.rating
+    copy.last_results = deque(genome.last_results, maxlen=genome.last_results.maxlen)
+    copy.steps = genome.steps
+    copy.wins = genome.wins
+    copy.losses = genome.losses
+    copy.draws = genome.draws
+    return copy
+
+def fighter_evolution_snapshots(num_vertices, population_size, evolver_kwargs, warmup_matches=10,
+                                num_children=10, num_elites=10):
+    """
+    Evolves fighters forever, for use with background.BackgroundEvolution.
+    After the warm-up and after every generation it yields a dict with copies of the num_elites best genomes per side,
+    the evolver steps and the (left_wins, right_wins, draws) of all generations so far.
+    """
+    evolver = FighterEvolver(num_vertices, population_size, **evolver_kwargs)
+    try:
+        evolver.evaluate_all_vs_n(n=warmup_matches)
+        results = np.zeros(3, dtype=int)
+        while True:
+            yield {
+                "steps": evolver.steps,
+                "results": tuple(results.tolist()),
+                "elites_left": [copy_fighter(genome) for genome in evolver.population_left.elite_select(num_elites)],
+                "elites_right": [copy_fighter(genome) for genome in evolver.population_right.elite_select(num_elites)],
+            }
+            results += evolver.evolve_generation(num_children=num_children)
+    finally:
+        # Only reached when the evolution is stopped, queued matches are no longer needed
+        evolver.close(abort=True)
+
+class FighterEvolver:
+    def __init__(self, num_vertices, population_size, evaluation_steps=300, num_workers=1,
+                 decision_steps=60, reuse_arenas=False, physics: PhysicsSettings = FIGHTER_PHYSICS,
+                 profiler=NULL_PROFILER):
+        """
+        Parameters
+        ----------
+        num_vertices : int
+            The number of body vertices of each fighter.
+        population_size : int
+            The size of the left and the right population.
+        evaluation_steps : int
+            The maximum number of physics steps of a single fight.
+        num_workers : int
+            The number of processes used by evaluate_matchups, 1 evaluates everything in this process.
+        decision_steps : int
+            A fight ends early once one side has been winning for this many consecutive steps, None always runs evaluation_steps.
+        reuse_arenas : bool
+            Fights reuse one arena per process instead of building a new world each time, which is faster.
+            Box2D keeps internal state between fights of a reused world though, so the results then depend on
+            which fights ran before in the same process and thereby on num_workers.
+        physics : PhysicsSettings
+            How the arena is stepped during fights, also used by renderers showing a fight.
+        profiler : Profiler
+            Times building, physics, rating and selection and counts steps and matches, see instrumentation.py.
+            Fights in pool processes are timed as a whole as the "pool" phase.
+        """
+        self.evaluation_steps = evaluation_steps
+        self.decision_steps = decision_steps
+        self.reuse_arenas = reuse_arenas
+        self.physics = physics
+        self.profiler = profiler
+        self.num_workers = num_workers
+        self._pool = None
+        
+        self.population_left = RankedPopulation(
+            population_size=population_size,
+            genome_fn=lambda: FighterGenome(body_vertices=num_vertices)
+        )
+        self.population_right = RankedPopulation(
+            population_size=population_size,
+            genome_fn=lambda: FighterGenome(body_vertices=num_vertices)
+        )
+        
+        self.steps = 0
+        
+        for genome in self.population_left.genomes:
+            self._init_genome(genome)
+        for genome in self.population_right.genomes:
+            self._init_genome(genome)
+        self.ratings_left = RatingIndex(self.population_left.genomes)
+        self.ratings_right = RatingIndex(self.population_right.genomes)
+        self.rating_engine = TrueSkill1vs1()
+    
+    def evolve_new_genome_left(self, num_evaluations=5, child=None):
+        # Generate a new child
+        if child is None:
+            child = self._create_child(self.population_left, LEFT_MUTATION_RATE)
+        # Add to population
+        with self.profiler.phase("selection"):
+            replaced = self.population_left.replace_weak_genome(child)
+        self.ratings_left.replace(replaced, child)
+        # Evaluate genome
+        for i in range(num_evaluations):
+            opponent = self._find_fair_opponent(child, self.ratings_right)
+            _, _, _ = self.evaluate_matchup(child, opponent)
+            
+        self.steps +=1
+    
+    def evolve_new_genome_right(self, num_evaluations=5, child=None):
+        # Generate a new child
+        if child is None:
+            child = self._create_child(self.population_right, RIGHT_MUTATION_RATE)
+        # Add to population
+        with self.profiler.phase("selection"):
+            replaced = self.population_right.replace_weak_genome(child)
+        self.ratings_right.replace(replaced, child)
+        # Evaluate genome
+        for i in range(num_evaluations):
+            opponent = self._find_fair_opponent(child, self.ratings_left)
+            _, _, _, = self.evaluate_matchup(opponent, child)
+            
+        self.steps += 1
+    
+    def evolve_generation(self, num_children=10, num_matches=2, num_candidates=None, race_steps=None):
+        """
+        Adds num_children new genomes to each population and lets every left genome fight num_matches times.
+        If num_candidates is larger than num_children, that many children per side first race against each other
+        and only the num_children winners are added, see race_children.
+        Returns the number of (left_wins, right_wins, draws) of these fights.
+        """
+        if num_candidates is None or num_candidates <= num_children:
+            for _ in range(num_children):
+                self.evolve_new_genome_left()
+                self.evolve_new_genome_right()
+        else:
+            children_left = self.race_children(True, num_candidates, num_children, race_steps)
+            children_right = self.race_children(False, num_candidates, num_children, race_steps)
+            for child_left, child_right in zip(children_left, children_right):
+                self.evolve_new_genome_left(child=child_left)
+                self.evolve_new_genome_right(child=child_right)
+        
+        return self.evaluate_all_vs_n(n=num_matches)
+    
+    def race_children(self, is_left, num_candidates, num_survivors, race_steps=None):
+        """
+        Breeds num_candidates children for one side and selects num_survivors of them by successive halving.
+        In each round all remaining children fight the same elite opponent and the better half by mean fitness continues,
+        the fights start with race_steps steps and get twice as long each round, up to evaluation_steps.
+        The fights use the screening physics if there is one and are not recorded, so ratings only see full fights.
+        """
+        if is_left:
+            population, mutation_rate, opponents = self.population_left, LEFT_MUTATION_RATE, self.population_right
+        else:
+            population, mutation_rate, opponents = self.population_right, RIGHT_MUTATION_RATE, self.population_left
+        candidates = [self._create_child(population, mutation_rate) for _ in range(num_candidates)]
+        results = {id(child): [] for child in candidates}
+        physics = self.physics.screening or self.physics
+        steps = race_steps or max(1, self.evaluation_steps // 4)
+        
+        while len(candidates) > num_survivors:
+            opponent = np.random.choice(opponents.elite_select(10))
+            matchups = [(child, opponent) if is_left else (opponent, child) for child in candidates]
+            for child, result in zip(candidates, self.simulate_matchups(matchups, steps, physics)):
+                fitness_left, fitness_right, _, _, _ = result
+                results[id(child)].append(fitness_left if is_left else fitness_right)
+            
+            candidates.sort(key=lambda x: np.mean(results[id(x)]), reverse=True)
+            candidates = candidates[:max(num_survivors, len(candidates) // 2)]
+            steps = min(steps * 2, self.evaluation_steps)
+        return candidates
+    
+    def get_random_matchup(self):
+        random_left = np.random.choice(self.population_left.genomes)
+        random_right = np.random.choice(self.population_right.genomes)
+        return (random_left, random_right)
+    
+    def get_elite_matchup(self):
+        elites_left = self.population_left.elite_select(10)
+        elites_right = self.population_right.elite_select(10)
+        return np.random.choice(elites_left), np.random.choice(elites_right)
+    
+    def get_fair_matchup(self):
+        random_left = np.random.choice(self.population_left.genomes)
+        opponent = self._find_fair_opponent(random_left, self.ratings_right)
+        return random_left, opponent
+    
+    def evaluate_random_matches(self, n=20):
+        for _ in range(n):
+            left, right = self.get_fair_matchup()
+            _, _, _ = self.evaluate_matchup(left, right)
+    
+    def evaluate_n_ranked_matches(self, n=1):
+        """
+        Matches every genome against its fairest opponent, n times.
+        The opponents for one side are picked before the fights of that side, so the fights can run in parallel.
+        """
+        outcomes = []
+        for _ in range(n):
+            matchups = [(genome, self._find_fair_opponent(genome, self.ratings_right))
+                        for genome in self.population_left.genomes]
+            outcomes += self.evaluate_matchups(matchups)
+                
+            matchups = [(self._find_fair_opponent(genome, self.ratings_left), genome)
+                        for genome in self.population_right.genomes]
+            outcomes += self.evaluate_matchups(matchups)
+        return _count_outcomes(outcomes)
+    
+    def evaluate_all_vs_n(self, n=5):
+        """
+        Will take all genomes from one population and match them against n from the other population.
+        As such this will result in population_size * n matches, and the genomes from each population will participated in n matches.
+        This method is expensive, but good for initializing a random population
+        """
+        opponents = self.population_right.genomes * n
+        np.random.shuffle(opponents)
+        matchups = []
+        for i, genome in enumerate(self.population_left.genomes):
+            for opponent in opponents[i*n:i*n+n]:
+                matchups.append((genome, opponent))
+        return _count_outcomes(self.evaluate_matchups(matchups))
+            
+    def evaluate_matchup(self, genome_left, genome_right):
+        result = simulate_matchup(genome_left, genome_right, self.evaluation_steps, self.decision_steps,
+                                  self.reuse_arenas, self.physics, self.profiler)
+        outcome, = self._record_matchups([(genome_left, genome_right)], [result])
+        return outcome
+    
+    def evaluate_matchups(self, matchups):
+        """
+        Evaluates a list of (genome_left, genome_right) matchups, using a process pool if num_workers > 1.
+        The results are recorded afterwards in the order of the list, so the ratings do not depend on the number of workers
+        unless reuse_arenas is set.
+        Returns a list of (left_won, right_won, draw) tuples.
+        """
+        return self._record_matchups(matchups, self.simulate_matchups(matchups))
+    
+    def simulate_matchups(self, matchups, evaluation_steps=None, physics=None):
+        """
+        Simulates a list of (genome_left, genome_right) matchups without recording the results.
+        Returns a list of simulate_matchup results.
+        """
+        evaluation_steps = evaluation_steps or self.evaluation_steps
+        physics = physics or self.physics
+        if self.num_workers > 1 and len(matchups) > 1:
+            jobs = [(left.get_parameters(), right.get_parameters(), evaluation_steps, self.decision_steps,
+                     self.reuse_arenas, physics) for left, right in matchups]
+            chunksize = max(1, len(jobs) // (self.num_workers * 4))
+            with self.profiler.phase("pool"):
+                return self._get_pool().map(_simulate_matchup_worker, jobs, chunksize=chunksize)
+        return [simulate_matchup(left, right, evaluation_steps, self.decision_steps, self.reuse_arenas, physics,
+                                 self.profiler)
+                for left, right in matchups]
+    
+    def close(self, abort=False):
+        """
+        Shuts the worker pool down, abort stops the workers without waiting for queued matches.
+        """
+        if self._pool is not None:
+            if abort:
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+            self._pool = None
+    
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers)
+        return self._pool
+    
+    def _record_matchups(self, matchups, results):
+        """
+        Records the results of simulate_matchup for each (genome_left, genome_right) matchup, in order.
+        The ratings of all matchups are updated together, see rating.rate_matches.
+        """
+        outcomes = []
+        scores = []
+        for (genome_left, genome_right), result in zip(matchups, results):
+            fitness_left, fitness_right, left_won, right_won, draw = result
+            self.profiler.count("matches")
+            genome_left.last_results.append(fitness_left)
+            genome_right.last_results.append(fitness_right)
+            with self.profiler.phase("selection"):
+                self.population_left.update_fitness(genome_left, np.mean(genome_left.last_results))
+                self.population_right.update_fitness(genome_right, np.mean(genome_right.last_results))
+            
+            if draw:
+                # Either True/True or False/False, aka a draw
+                scores.append(0)
+                genome_left.draws += 1
+                genome_right.draws += 1
+            elif left_won:
+                scores.append(1)
+                genome_left.wins += 1
+                genome_right.losses += 1
+            elif right_won: # Redundant if but whatever
+                scores.append(-1)
+                genome_left.losses += 1
+                genome_right.wins += 1
+            outcomes.append((left_won, right_won, draw))
+        
+        with self.profiler.phase("rating"):
+            rate_matches(self.rating_engine, self.ratings_left, self.ratings_right, matchups, scores)
+        return outcomes
+    
+    def create_arena(self, genome_left, genome_right):
+        return create_arena(genome_left, genome_right, self.physics.merge_body_fixtures)
+    
+    def _find_fair_opponent(self, genome, opponent_ratings):
+        with self.profiler.phase("rating"):
+            return opponent_ratings.best_opponent(genome.rating)
+    
+    def _create_child(self, population, mutation_rate):
+        with self.profiler.phase("selection"):
+            child, = population.roulette_wheel_crossover(num_children=1)
+            child.mutate(mutation_rate)
+        self._init_genome(child)
+        self.profiler.count("genomes")
+        return child
+    
+    def _init_genome(self, genome):
+        genome.last_results = deque(maxlen=5)
+        genome.rating = Rating()
+        genome.steps = self.steps
+        genome.wins = 0
+        genome.losses = 0
+        genome.draws = 0
@@ -1,44 +1,180 @@
+import math
+import time
 import pygame
 from pygame import Vector2
 
 from abc import ABC, abstractmethod
+from instrumentation import NULL_PROFILER
+
+class StaticLayer:
+    """
+    Static geometry rasterized once into square chunks of transparent surfaces.
+    Rendering only blits the chunks overlapping the screen, so the cost per frame does not depend on the amount of geometry.
+    Points are world pixel coordinates, like the ones passed to GameBase.draw_polygon.
+    """
+    def __init__(self, chunk_size=512):
+        self.chunk_size = chunk_size
+        self._shapes = {}
+        self._chunks = {}
+    
+    def add_polygon(self, color, points):
+        points = [Vector2(p) for p in points]
+        xs = [p.x for p in points]
+        ys = [p.y for p in points]
+        self._add_shape((min(xs), min(ys), max(xs), max(ys)),
+                        lambda surface, offset: pygame.draw.polygon(surface, color, [p - offset for p in points]))
+    
+    def add_circle(self, color, center, radius):
+        center = Vector2(center)
+        bounds = (center.x - radius, center.y - radius, center.x + radius, center.y + radius)
+        self._add_shape(bounds, lambda surface, offset: pygame.draw.circle(surface, color, center - offset, radius))
+    
+    def add_line(self, color, start_pos, end_pos, width=1):
+        start_pos, end_pos = Vector2(start_pos), Vector2(end_pos)
+        bounds = (min(start_pos.x, end_pos.x) - width, min(start_pos.y, end_pos.y) - width,
+                  max(start_pos.x, end_pos.x) + width, max(start_pos.y, end_pos.y) + width)
+        self._add_shape(bounds, lambda surface, offset: pygame.draw.line(surface, color, start_pos - offset,
+                                                                        end_pos - offset, width))
+    
+    def render(self, game):
+        size = self.chunk_size
+        left, top = game.camera_pos
+        for cx in range(math.floor(left / size), math.floor((left + game.screen_width) / size) + 1):
+            for cy in range(math.floor(top / size), math.floor((top + game.screen_height) / size) + 1):
+                chunk = self._get_chunk(cx, cy)
+                if chunk is not None:
+                    game.screen.blit(chunk, (round(cx * size - left), round(cy * size - top)))
+    
+    def _add_shape(self, bounds, draw_fn):
+        # Remember the shape in every chunk its bounding box touches
+        min_x, min_y, max_x, max_y = bounds
+        size = self.chunk_size
+        for cx in range(math.floor(min_x / size), math.floor(max_x / size) + 1):
+            for cy in range(math.floor(min_y / size), math.floor(max_y / size) + 1):
+                self._shapes.setdefault((cx, cy), []).append(draw_fn)
+                self._chunks.pop((cx, cy), None)
+    
+    def _get_chunk(self, cx, cy):
+        shapes = self._shapes.get((cx, cy))
+        if shapes is None:
+            return None
+        chunk = self._chunks.get((cx, cy))
+        if chunk is None:
+            # Rasterize on first use
+            chunk = pygame.Surface((self.chunk_size, self.chunk_size), pygame.SRCALPHA)
+            offset = Vector2(cx * self.chunk_size, cy * self.chunk_size)
+            for draw_fn in shapes:
+                draw_fn(chunk, offset)
+            self._chunks[(cx, cy)] = chunk
+        return chunk
 
 class GameBase(ABC):
-    def __init__(self, title, screen_width, screen_height, fps=60):
-        pygame.init()
+    SPEED_KEYS = {pygame.K_PLUS: 2, pygame.K_KP_PLUS: 2, pygame.K_EQUALS: 2, pygame.K_MINUS: 0.5, pygame.K_KP_MINUS: 0.5}
+    TURBO_KEY = pygame.K_t
+    
+    def __init__(self, title, screen_width, screen_height, fps=60, speed=1.0, max_steps_per_frame=8, turbo=False):
+        """
+        The simulation advances in fixed steps of 1 / fps seconds, independent of how long rendering takes.
+
+        Parameters
+        ----------
+        speed : float
+            Simulated seconds per real second, + and - double and halve it while running.
+        max_steps_per_frame : int
+            Fixed steps per rendered frame are capped, the simulation slows down instead of never rendering again.
+            This also caps the speed, at most max_steps_per_frame steps fit into a frame.
+        turbo : bool
+            Runs as many fixed steps as fit into the time of a frame, ignoring speed. T toggles it while running.
+        """
+        # Only what a window needs, pygame.init() would also start audio and joysticks
+        pygame.display.init()
+        pygame.font.init()
         
         self.fps = fps
         self.fixed_delta_time = 1. / self.fps
+        self.speed = speed
+        self.max_steps_per_frame = max_steps_per_frame
+        self.turbo = turbo
         self.clock = pygame.time.Clock()
         self.background_color = pygame.Color("white")
         self.screen_width = screen_width
         self.screen_height = screen_height
 
         self.camera_pos = Vector2(0,0)
+        self.profiler = NULL_PROFILER
         
         self.screen = pygame.display.set_mode((screen_width, screen_height), 0, 32)
         pygame.display.set_caption(title)
         
     def run(self):
+        try:
+            self._run_loop()
+        finally:
+            # Also stop background work when the loop failed, a running child process would keep the interpreter alive
+            self.close()
+            pygame.quit()
+    
+    def _run_loop(self):
         running = True
+        accumulator = 0
+        render_time = 0
+        self.clock.tick()
         while running:
+            frame_start = time.perf_counter()
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT: # The user closed the window or pressed escape
                     running = False
                 else:
+                    self._handle_speed_keys(event)
                     self.handle_event(event)
             
             # Simulate
-            self.fixed_step(self.fixed_delta_time)
+            if self.turbo:
+                # Use what is left of the frame after the last render for simulation, at least one step
+                accumulator = 0
+                simulation_budget = 1. / self.fps - render_time
+                self.fixed_step(self.fixed_delta_time)
+                while time.perf_counter() - frame_start < simulation_budget:
+                    self.fixed_step(self.fixed_delta_time)
+            else:
+                accumulator += self.clock.get_time() / 1000 * self.speed
+                steps = 0
+                while accumulator >= self.fixed_delta_time and steps < self.max_steps_per_frame:
+                    self.fixed_step(self.fixed_delta_time)
+                    accumulator -= self.fixed_delta_time
+                    steps += 1
+                if steps == self.max_steps_per_frame:
+                    # Drop the time we could not catch up on
+                    accumulator = min(accumulator, self.fixed_delta_time)
             # Render
-            self.screen.fill(self.background_color)
-            self.render()
+            render_start = time.perf_counter()
+            with self.profiler.phase("render"):
+                self.screen.fill(self.background_color)
+                self.render()
             # Display newly rendered frame
             pygame.display.flip()
+            render_time = time.perf_counter() - render_start
             # Wait to render the next frame
             self.clock.tick(self.fps)
-        pygame.quit()
+    
+    def close(self):
+        """
+        Called when the window was closed, override to stop background work.
+        """
+        pass
+    
+    def speed_text(self):
+        return "Speed: turbo" if self.turbo else f"Speed: x{self.speed:g}"
+    
+    def _handle_speed_keys(self, event):
+        if event.type != pygame.KEYDOWN:
+            return
+        if event.key in GameBase.SPEED_KEYS:
+            # Faster than max_steps_per_frame steps per frame would only change the displayed speed
+            self.speed = min(max(self.speed * GameBase.SPEED_KEYS[event.key], 1. / 16), self.max_steps_per_frame)
+        elif event.key == GameBase.TURBO_KEY:
+            self.turbo = not self.turbo
     
     def draw_line(self, color, start_pos, end_pos, width=0):
         pygame.draw.line(self.screen, color, start_pos - self.camera_pos, end_pos - self.camera_pos, width)
@@ -48,6 +184,16 @@ class GameBase(ABC):
         
     def draw_polygon(self, color, points, width=0):
         pygame.draw.polygon(self.screen, color, [p - self.camera_pos for p in points], width)
+    
+    def draw_lines(self, color, points, closed=False, width=1):
+        pygame.draw.lines(self.screen, color, closed, [p - self.camera_pos for p in points], width)
+    
+    def is_visible(self, center, radius):
+        """
+        Returns whether a circle in world pixel coordinates overlaps the screen.
+        """
+        x, y = center - self.camera_pos
+        return -radius <= x <= self.screen_width + radius and -radius <= y <= self.screen_height + radius
         
     def move_camera(self, delta):
         self.camera_pos += delta
@@ -0,0 +1,86 @@
+import numpy as np
+
+from genomes import CarGenome
+
+def _row_property(name):
+    def get(self):
+        return getattr(self.arrays, name)[self.index]
+
+    def set(self, value):
+        getattr(self.arrays, name)[self.index] = value
+
+    return property(get, set)
+
+class CarGenomeArrays:
+    """
+    Stores a whole population of car genomes as rows of shared 2-D arrays.
+    Mutation and crossover work on all rows at once, CarGenomeView exposes a single row as a genome.
+    """
+    FIELDS = ("magnitudes", "angles", "wheels_flags", "wheel_size", "fitness")
+
+    def __init__(self, population_size, body_vertices=10):
+        shape = (population_size, body_vertices)
+        self.magnitudes = np.random.uniform(0.1, 4, size=shape)
+        self.angles = np.random.uniform(0, 1, size=shape)
+        self.wheels_flags = np.random.randint(0, 2, size=shape, dtype=bool)
+        self.wheel_size = np.random.uniform(0.1, 1, size=shape)
+        self.fitness = np.zeros(population_size)
+
+    def take(self, indices):
+        """
+        Returns a copy of the given rows as a new set of arrays.
+        """
+        arrays = self.__class__.__new__(self.__class__)
+        for field in self.FIELDS:
+            setattr(arrays, field, getattr(self, field)[indices])
+        return arrays
+
+    def concatenate(self, other):
+        arrays = self.__class__.__new__(self.__class__)
+        for field in self.FIELDS:
+            setattr(arrays, field, np.concatenate([getattr(self, field), getattr(other, field)]))
+        return arrays
+
+    def mutate(self, mutation_rate=0.1):
+        shape = self.magnitudes.shape
+        mask = np.random.uniform(0, 1, size=shape) < mutation_rate
+        self.magnitudes[mask] = np.random.uniform(0.1, 4, size=mask.sum())
+        mask = np.random.uniform(0, 1, size=shape) < mutation_rate
+        self.angles[mask] = np.random.uniform(0, 1, size=mask.sum())
+        mask = np.random.uniform(0, 1, size=shape) < mutation_rate
+        self.wheels_flags[mask] = ~self.wheels_flags[mask]
+        mask = np.random.uniform(0, 1, size=shape) < mutation_rate
+        self.wheel_size[mask] = np.random.uniform(0.1, 1.5, size=mask.sum())
+
+    def crossover(self, other: "CarGenomeArrays"):
+        """
+        Crosses row i of self with row i of other, modifying both like CarGenome.crossover.
+        """
+        t = np.random.uniform(0, 1, size=self.magnitudes.shape)
+        for field in ("magnitudes", "angles", "wheel_size"):
+            a = getattr(self, field)
+            b = getattr(other, field)
+            setattr(self, field, (1 - t) * a + t * b)
+            setattr(other, field, t * a + (1 - t) * b)
+
+    def views(self):
+        return [CarGenomeView(self, i) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.magnitudes)
+
+class CarGenomeView(CarGenome):
+    """
+    A CarGenome backed by one row of a CarGenomeArrays, changes to the genome are written into the arrays.
+    """
+    wheel_motor_speed = 10.0
+
+    magnitudes = _row_property("magnitudes")
+    angles = _row_property("angles")
+    wheels_flags = _row_property("wheels_flags")
+    wheel_size = _row_property("wheel_size")
+    fitness = _row_property("fitness")
+
+    def __init__(self, arrays, index):
+        self.arrays = arrays
+        self.index = index
@@ -1,17 +1,33 @@
+import sys
+
 from game_base import GameBase
+from rendering import render_car
 from genomes import CarGenome
+from checkpoint import load_genomes
 from Box2D import b2World, b2PolygonShape
 from constants import PPM
+from physics import CAR_PHYSICS
 from pygame import Vector2
 
 import pygame
 
 class GenomeVisualizer(GameBase):
-    def __init__(self, screen_width, screen_height):
+    def __init__(self, screen_width, screen_height, checkpoint=None, physics=CAR_PHYSICS):
         super().__init__("Genome Visualizer", screen_width, screen_height)
+        self.physics = physics
         
-        self.genome_left = CarGenome(body_vertices=10)
-        self.genome_right = CarGenome(body_vertices=10)
+        if checkpoint is None:
+            self.genome_left = CarGenome(body_vertices=10)
+            self.genome_right = CarGenome(body_vertices=10)
+        else:
+            # Show the two best cars, or the best fighter of each side
+            populations = load_genomes(checkpoint)
+            if len(populations) == 1:
+                (_, genomes), = populations
+                self.genome_left, self.genome_right = genomes[:2]
+            else:
+                (_, genomes_left), (_, genomes_right) = populations
+                self.genome_left, self.genome_right = genomes_left[0], genomes_right[0]
         
         self.init()
         self.move_camera((-screen_width//2,0))
@@ -26,15 +42,15 @@ class GenomeVisualizer(GameBase):
         )
         
     def fixed_step(self, delta_time):
-        self.world.Step(2./60,10,10)
+        self.physics.step(self.world)
     
     def render(self):
         ground_shape = self.floor.fixtures[0].shape
         vertices = [(self.floor.transform * v) * PPM for v in ground_shape.vertices]
         self.draw_polygon(pygame.Color("GRAY"), vertices)
         
-        self.car_left.render(self)
-        self.car_right.render(self)
+        render_car(self.car_left, self)
+        render_car(self.car_right, self)
     
     def handle_event(self, event):
         if event.type == pygame.KEYDOWN:
@@ -46,5 +62,6 @@ class GenomeVisualizer(GameBase):
                 self.init()
     
 if __name__ == "__main__":
-    renderer = GenomeVisualizer(800, 600)
+    # Optionally pass a checkpoint written by headless.py
+    renderer = GenomeVisualizer(800, 600, checkpoint=sys.argv[1] if len(sys.argv) > 1 else None)
     renderer.run()
\ No newline at end of file
@@ -3,12 +3,97 @@ import math
 
 from Box2D import (
     b2Vec2, b2World, b2BodyDef, b2CircleShape,
-    b2FixtureDef, b2PolygonShape, b2_dynamicBody
+    b2FixtureDef, b2PolygonShape, b2_dynamicBody, b2_maxPolygonVertices
 )
-from pygame import Vector2
-
 from phenomes import Car
 
+# Collision category of car fixtures, cars in their own collision group only collide with themselves and the floor
+CAR_CATEGORY = 0x0002
+
+def collision_filter(collision_group):
+    if collision_group == 0:
+        return {}
+    return {
+        "groupIndex": collision_group,
+        "categoryBits": CAR_CATEGORY,
+        "maskBits": 0xFFFF & ~CAR_CATEGORY,
+    }
+
+def body_geometry(genome):
+    """
+    Returns the body vertices as an (n, 2) array and the indices of the vertices carrying a wheel.
+    Vertex i lies at magnitudes[i] from the center, at the running sum of the angles normalized to a full turn.
+    The result is cached on the genome until it is mutated or crossed over.
+    """
+    geometry = getattr(genome, "_body_geometry", None)
+    if geometry is None:
+        angles = np.cumsum(genome.angles) / np.sum(genome.angles) * 2 * math.pi
+        vertices = np.stack([genome.magnitudes * np.cos(angles), genome.magnitudes * np.sin(angles)], axis=1)
+        geometry = (vertices, np.flatnonzero(genome.wheels_flags))
+        genome._body_geometry = geometry
+    return geometry
+
+def cross_2d(a, b):
+    """
+    Returns the z component of the cross products of two (n, 2) arrays of vectors.
+    """
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+def merge_fan_triangles(vertices, max_vertices=b2_maxPolygonVertices):
+    """
+    Groups the triangles (vertices[i], vertices[i + 1], center) of a body into as few convex polygons as possible.
+    Returns a list of vertex index lists, every polygon consists of its vertices and the center.
+    A polygon spans less than half a turn, turns left at each of its inner vertices and has at most max_vertices,
+    so only concave corners of the outline split the body into more pieces.
+    """
+    num_vertices = len(vertices)
+    following = np.roll(vertices, -1, axis=0)
+    previous = np.roll(vertices, 1, axis=0)
+    turns = np.arctan2(cross_2d(vertices, following), np.sum(vertices * following, axis=1))
+    convex = cross_2d(vertices - previous, following - vertices) > 0
+    turns, convex = turns.tolist(), convex.tolist()
+
+    best = None
+    # The greedy merge is optimal for a fixed first triangle, so try all of them
+    for start in range(num_vertices):
+        pieces = []
+        piece, span = None, 0
+        for i in range(start, start + num_vertices):
+            i %= num_vertices
+            if (piece is not None and convex[i] and turns[i] > 0 and span + turns[i] < math.pi
+                    and len(piece) + 2 <= max_vertices):
+                piece.append((i + 1) % num_vertices)
+                span += turns[i]
+            else:
+                piece = [i, (i + 1) % num_vertices]
+                span = turns[i]
+                pieces.append(piece)
+                if turns[i] <= 0:
+                    # A folded triangle is never merged
+                    piece = None
+        if best is None or len(pieces) < len(best):
+            best = pieces
+    return best
+
+def body_polygons(genome, vertices, merge_fixtures=False):
+    """
+    Returns the polygons making up the body of the car, either one triangle per vertex or the merged convex pieces.
+    vertices are the possibly mirrored body vertices, mirroring does not change which triangles can be merged.
+    """
+    if not merge_fixtures:
+        return [[vertices[i], vertices[(i + 1) % len(vertices)], (0, 0)] for i in range(len(vertices))]
+
+    geometry = body_geometry(genome)
+    cached = getattr(genome, "_body_pieces", None)
+    if cached is None or cached[0] is not geometry:
+        cached = (geometry, merge_fan_triangles(geometry[0]))
+        genome._body_pieces = cached
+    return [[vertices[i] for i in piece] + [(0, 0)] for piece in cached[1]]
+
+def _copy_parameters(parameters):
+    return {key: value.copy() if isinstance(value, np.ndarray) else value
+            for key, value in parameters.items()}
+
 class CarGenome:
     def __init__(self, body_vertices=10):
         self.magnitudes = np.random.uniform(0.1, 4, size=body_vertices)
@@ -18,7 +103,34 @@ class CarGenome:
         self.wheel_motor_speed = 10.0
         self.fitness = 0
 
+    def get_parameters(self):
+        """
+        Returns the genetic parameters as a picklable dict, without any evaluation bookkeeping.
+        """
+        return {
+            "magnitudes": self.magnitudes,
+            "angles": self.angles,
+            "wheels_flags": self.wheels_flags,
+            "wheel_size": self.wheel_size,
+            "wheel_motor_speed": self.wheel_motor_speed,
+        }
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        genome = cls.__new__(cls)
+        for key, value in parameters.items():
+            setattr(genome, key, value)
+        genome.fitness = 0
+        return genome
+
+    def clone(self):
+        """
+        Returns a copy of the genetic parameters, evaluation bookkeeping like the fitness is not copied.
+        """
+        return CarGenome.from_parameters(_copy_parameters(self.get_parameters()))
+
     def mutate(self, mutation_rate=0.1):
+        self._body_geometry = None
         mag_indices = np.where(np.random.uniform(0, 1, size=len(self.magnitudes)) < mutation_rate)
         angle_indices = np.where(np.random.uniform(0, 1, size=len(self.angles)) < mutation_rate)
         wheel_indices = np.where(np.random.uniform(0, 1, size=len(self.wheels_flags)) < mutation_rate)
@@ -30,6 +142,8 @@ class CarGenome:
         self.wheel_size[indices] = np.random.uniform(0.1, 1.5, size=len(self.wheel_size[indices]))
 
     def crossover(self, other: "CarGenome"):
+        self._body_geometry = None
+        other._body_geometry = None
         #t = np.random.uniform(0, 1)
         t = np.random.uniform(0, 1, size=len(self.magnitudes))
         new_magnitudes = t * self.magnitudes + (1 - t) * other.magnitudes
@@ -43,30 +157,29 @@ class CarGenome:
         other.angles = new_angles
         other.wheel_size = new_size
 
-    def create_car(self, world: b2World, position, is_flipped=False):
-        vertices = []
-        total_angle_sum = sum(self.angles)
-        running_angle_sum = 0
-        for m, a in zip(self.magnitudes, self.angles):
-            running_angle_sum += a
-
-            vec = Vector2(1, 0)
-            vec = vec.rotate((running_angle_sum / total_angle_sum) * 360)
-            vec *= m
-            vertices.append(tuple(vec))
-
+    def create_car(self, world: b2World, position, is_flipped=False, collision_group=0, merge_fixtures=False):
+        """
+        Builds the car in the given world.
+        A positive collision_group keeps the car from colliding with other cars, which allows many cars to share one world.
+        merge_fixtures builds the body from the fewest convex polygons instead of a triangle per vertex,
+        the shape and mass stay the same.
+        """
+        vertices, wheel_indices = body_geometry(self)
         wheel_speed = self.wheel_motor_speed
         if is_flipped:
-            vertices = [(-x, y) for x, y in vertices]
+            vertices = vertices * (-1, 1)
             wheel_speed = -wheel_speed
+        wheel_anchors = vertices[wheel_indices].tolist()
+        wheel_sizes = self.wheel_size[wheel_indices].tolist()
+        vertices = vertices.tolist()
 
         car = world.CreateDynamicBody(position=position)
         body_parts = []
-        for i in range(len(vertices)):
-            triangle = [vertices[i], vertices[(i+1) % len(vertices)], (0, 0)]
-            body_parts.append(car.CreatePolygonFixture(vertices=triangle, density=1))
-        wheels, wheels_bodies = self._create_wheels_bodies(world, car, vertices)
-        return Car(car, wheels_bodies, wheel_motor_speed=wheel_speed)
+        for polygon in body_polygons(self, vertices, merge_fixtures):
+            body_parts.append(car.CreatePolygonFixture(vertices=polygon, density=1,
+                                                       **collision_filter(collision_group)))
+        wheels, wheels_bodies = self._create_wheels_bodies(world, car, wheel_anchors, wheel_sizes, collision_group)
+        return Car(car, wheels_bodies, wheel_motor_speed=wheel_speed, outline=vertices)
 
     # def create_body(self, world: b2World, position):
     #     vertices = []
@@ -91,21 +204,18 @@ class CarGenome:
         vertices = [v1, v2, (0, 0)]
         body.CreatePolygonFixture(vertices=vertices, density=density)
 
-    def _create_wheels_bodies(self, world, body, vertices):
+    def _create_wheels_bodies(self, world, body, wheel_anchors, wheel_sizes, collision_group=0):
         wheels = []
         wheels_bodies = []
-        for wheel_ind, is_wheel in enumerate(self.wheels_flags):
-            if not is_wheel:
-                continue
-
-            vertex = vertices[wheel_ind]
+        for vertex, wheel_size in zip(wheel_anchors, wheel_sizes):
             angle = 0  # np.random.uniform(0, 2 * math.pi)
             wheel_body = world.CreateDynamicBody(
                 position=body.worldCenter + b2Vec2(vertex[0], vertex[1]),
                 # angle=angle
             )
-            wheel_shape = b2CircleShape(radius=self.wheel_size[wheel_ind])
-            wheel_fixture = b2FixtureDef(shape=wheel_shape, density=5.0, friction=1)
+            wheel_shape = b2CircleShape(radius=wheel_size)
+            wheel_fixture = b2FixtureDef(shape=wheel_shape, density=5.0, friction=1,
+                                         **collision_filter(collision_group))
             wheel_body.CreateFixture(wheel_fixture)
             wheel_joint = world.CreateRevoluteJoint(
                 bodyA=body,
@@ -124,10 +234,10 @@ class CarGenome:
         return wheels, wheels_bodies
 
 class FighterGenome:
-    def __init__(self, body_vertices=10):
-        self.min_body_density = 0.1
-        self.max_body_density = 10
+    min_body_density = 0.1
+    max_body_density = 10
 
+    def __init__(self, body_vertices=10):
         self.magnitudes = np.random.uniform(0.1, 4, size=body_vertices)
         self.angles = np.random.uniform(0, 1, size=body_vertices)
         self.wheels_flags = np.random.randint(0, 2, size=body_vertices, dtype=bool)
@@ -137,7 +247,36 @@ class FighterGenome:
         self.wheel_motor_speed = 10.0
         self.fitness = 0
 
+    def get_parameters(self):
+        """
+        Returns the genetic parameters as a picklable dict, without any evaluation bookkeeping.
+        """
+        return {
+            "magnitudes": self.magnitudes,
+            "angles": self.angles,
+            "wheels_flags": self.wheels_flags,
+            "wheel_size": self.wheel_size,
+            "body_density": self.body_density,
+            "wheel_density": self.wheel_density,
+            "wheel_motor_speed": self.wheel_motor_speed,
+        }
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        genome = cls.__new__(cls)
+        for key, value in parameters.items():
+            setattr(genome, key, value)
+        genome.fitness = 0
+        return genome
+
+    def clone(self):
+        """
+        Returns a copy of the genetic parameters, evaluation bookkeeping like ratings and results is not copied.
+        """
+        return FighterGenome.from_parameters(_copy_parameters(self.get_parameters()))
+
     def mutate(self, mutation_rate=0.1):
+        self._body_geometry = None
         
         mag_indices = np.where(np.random.uniform(0, 1, size=len(self.magnitudes)) < mutation_rate)
         angle_indices = np.where(np.random.uniform(0, 1, size=len(self.angles)) < mutation_rate)
@@ -155,6 +294,8 @@ class FighterGenome:
             self.wheel_density = np.random.uniform(self.min_body_density, self.max_body_density)
 
     def crossover(self, other: "CarGenome"):
+        self._body_geometry = None
+        other._body_geometry = None
         # continuous crossover
         t = np.random.uniform(0, 1, size=len(self.magnitudes))
         new_magnitudes = t * self.magnitudes + (1 - t) * other.magnitudes
@@ -180,31 +321,26 @@ class FighterGenome:
         self.wheels_flags = np.where(t < 0.5, other.wheels_flags, self.wheels_flags)
         other.wheels_flags = new_wheels_flags
 
-    def create_car(self, world: b2World, position, is_flipped=False):
-        vertices = []
-        total_angle_sum = sum(self.angles)
-        running_angle_sum = 0
-        for m, a in zip(self.magnitudes, self.angles):
-            running_angle_sum += a
-
-            vec = Vector2(1, 0)
-            vec = vec.rotate((running_angle_sum / total_angle_sum) * 360)
-            vec *= m
-            vertices.append(tuple(vec))
-
+    def create_car(self, world: b2World, position, is_flipped=False, merge_fixtures=False):
+        """
+        Builds the fighter in the given world, see CarGenome.create_car for merge_fixtures.
+        """
+        vertices, wheel_indices = body_geometry(self)
         wheel_speed = self.wheel_motor_speed
         if is_flipped:
-            vertices = [(-x, y) for x, y in vertices]
+            vertices = vertices * (-1, 1)
             wheel_speed = -wheel_speed
+        wheel_anchors = vertices[wheel_indices].tolist()
+        wheel_sizes = self.wheel_size[wheel_indices].tolist()
+        vertices = vertices.tolist()
 
         car = world.CreateDynamicBody(position=position)
         body_parts = []
-        for i in range(len(vertices)):
-            triangle = [vertices[i], vertices[(i+1) % len(vertices)], (0, 0)]
-            body_parts.append(car.CreatePolygonFixture(vertices=triangle,
+        for polygon in body_polygons(self, vertices, merge_fixtures):
+            body_parts.append(car.CreatePolygonFixture(vertices=polygon,
                                                        density=self.body_density))
         wheels, wheels_bodies = self._create_wheels_bodies(world, car,
-                                                           vertices,
+                                                           wheel_anchors, wheel_sizes,
                                                            self.wheel_density)
         body_density_norm = (self.body_density - self.min_body_density) \
             / (self.max_body_density - self.min_body_density)
@@ -212,7 +348,8 @@ class FighterGenome:
             / (self.max_body_density - self.min_body_density)
         return Car(car, wheels_bodies, wheel_motor_speed=wheel_speed,
                    body_density=body_density_norm,
-                   wheel_density=wheel_density_norm)
+                   wheel_density=wheel_density_norm,
+                   outline=vertices)
 
     # def create_body(self, world: b2World, position):
     #     vertices = []
@@ -237,20 +374,16 @@ class FighterGenome:
         vertices = [v1, v2, (0, 0)]
         body.CreatePolygonFixture(vertices=vertices, density=density)
 
-    def _create_wheels_bodies(self, world, body, vertices, wheel_density):
+    def _create_wheels_bodies(self, world, body, wheel_anchors, wheel_sizes, wheel_density):
         wheels = []
         wheels_bodies = []
-        for wheel_ind, is_wheel in enumerate(self.wheels_flags):
-            if not is_wheel:
-                continue
-
-            vertex = vertices[wheel_ind]
+        for vertex, wheel_size in zip(wheel_anchors, wheel_sizes):
             angle = 0  # np.random.uniform(0, 2 * math.pi)
             wheel_body = world.CreateDynamicBody(
                 position=body.worldCenter + b2Vec2(vertex[0], vertex[1]),
                 # angle=angle
             )
-            wheel_shape = b2CircleShape(radius=self.wheel_size[wheel_ind])
+            wheel_shape = b2CircleShape(radius=wheel_size)
             wheel_fixture = b2FixtureDef(shape=wheel_shape,
                                          density=wheel_density, friction=1)
             wheel_body.CreateFixture(wheel_fixture)
@@ -0,0 +1,169 @@
+"""
+Runs car or fighter evolution without a window, as fast as the physics allows.
+
+    python headless.py car --generations 50
+    python headless.py fighter --population-size 100 --generations 20 --workers 8
+    python headless.py car --generations 50 --checkpoint-dir runs/car
+    python headless.py car --generations 50 --checkpoint-dir runs/car --resume runs/car/generation_00010.npz
+    python headless.py car --generations 50 --screening --rescore-fraction 0.3
+    python headless.py fighter --generations 20 --profile runs/fighter_profile.csv
+"""
+import argparse
+import multiprocessing
+import random
+import time
+import numpy as np
+
+from car_evolution import CarEvolver
+from fighter_evolution import FighterEvolver
+from population import ArrayPopulation
+from physics import PhysicsSettings, CAR_PHYSICS, FIGHTER_PHYSICS
+from instrumentation import Profiler, NULL_PROFILER, create_sink
+from genome_arrays import CarGenomeArrays
+from checkpoint import (
+    CheckpointWriter, load_checkpoint, car_checkpoint, restore_car_checkpoint,
+    fighter_checkpoint, restore_fighter_checkpoint
+)
+
+def run_car_evolution(args, profiler=NULL_PROFILER):
+    population = ArrayPopulation(
+        population_size=args.population_size,
+        arrays_fn=lambda n: CarGenomeArrays(n, body_vertices=args.num_vertices)
+    )
+    evolver = CarEvolver(population, num_iterations=args.steps or 1000, cars_per_world=args.cars_per_world,
+                         edge_floor=args.edge_floor, physics=physics_settings(args, CAR_PHYSICS), profiler=profiler)
+    if args.resume is not None:
+        restore_car_checkpoint(evolver, load_checkpoint(args.resume))
+    writer = CheckpointWriter(args.checkpoint_dir) if args.checkpoint_dir is not None else None
+
+    try:
+        while evolver.epochs < args.generations:
+            start = time.perf_counter()
+            evolver.evaluate_genomes()
+            fitness = np.array([genome.fitness for genome in evolver.population.genomes])
+            # Snapshot the evaluated generation, its children do not have a fitness yet
+            checkpoint = car_checkpoint(evolver) if writer is not None else None
+            evolver.generate_next_generation()
+            duration = time.perf_counter() - start
+            print(f"generation {evolver.epochs}: best {fitness.max():.2f}, mean {fitness.mean():.2f}, {duration:.2f}s",
+                  flush=True)
+            profiler.report(generation=evolver.epochs)
+            if writer is not None:
+                writer.write(checkpoint_name(evolver.epochs), checkpoint)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def run_fighter_evolution(args, profiler=NULL_PROFILER):
+    evolver = FighterEvolver(args.num_vertices, args.population_size,
+                             evaluation_steps=args.steps or 300, num_workers=args.workers,
+                             reuse_arenas=args.reuse_arenas, physics=physics_settings(args, FIGHTER_PHYSICS),
+                             profiler=profiler)
+    writer = CheckpointWriter(args.checkpoint_dir) if args.checkpoint_dir is not None else None
+    try:
+        if args.resume is not None:
+            generation = restore_fighter_checkpoint(evolver, load_checkpoint(args.resume))
+        else:
+            generation = 0
+            start = time.perf_counter()
+            left_wins, right_wins, draws = evolver.evaluate_all_vs_n(n=args.warmup_matches)
+            duration = time.perf_counter() - start
+            print(f"warm-up: L {left_wins}, R {right_wins}, D {draws}, {duration:.2f}s", flush=True)
+            profiler.report(generation=generation)
+
+        while generation < args.generations:
+            start = time.perf_counter()
+            left_wins, right_wins, draws = evolver.evolve_generation(num_children=args.children,
+                                                                     num_candidates=args.candidates,
+                                                                     race_steps=args.race_steps)
+            duration = time.perf_counter() - start
+            best_left, = evolver.population_left.elite_select(1)
+            best_right, = evolver.population_right.elite_select(1)
+            generation += 1
+            print(f"generation {generation}: L {left_wins}, R {right_wins}, D {draws}, "
+                  f"best left {best_left.fitness:.2f}, best right {best_right.fitness:.2f}, {duration:.2f}s",
+                  flush=True)
+            profiler.report(generation=generation)
+            if writer is not None:
+                writer.write(checkpoint_name(generation), fighter_checkpoint(evolver, generation))
+    finally:
+        evolver.close()
+        if writer is not None:
+            writer.close()
+
+def physics_settings(args, default):
+    physics = PhysicsSettings(
+        time_step=args.time_step or default.time_step,
+        velocity_iterations=args.velocity_iterations,
+        position_iterations=args.position_iterations,
+        merge_body_fixtures=args.merge_fixtures,
+    )
+    if args.screening:
+        physics = physics.with_screening(rescore_fraction=args.rescore_fraction)
+    return physics
+
+def checkpoint_name(generation):
+    return f"generation_{generation:05d}.npz"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run evolution without opening a window.")
+    parser.add_argument("mode", choices=["car", "fighter"])
+    parser.add_argument("--population-size", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=None,
+                        help="Physics steps per evaluation, defaults to 1000 for cars and 300 for fighters.")
+    parser.add_argument("--num-vertices", type=int, default=10)
+    parser.add_argument("--time-step", type=float, default=None,
+                        help="Simulated seconds per physics step, defaults to 2/60 for cars and 1/60 for fighters.")
+    parser.add_argument("--velocity-iterations", type=int, default=10)
+    parser.add_argument("--position-iterations", type=int, default=10)
+    parser.add_argument("--merge-fixtures", action="store_true",
+                        help="Build car bodies from merged convex polygons instead of a triangle per vertex.")
+    parser.add_argument("--screening", action="store_true",
+                        help="Evaluate cars with fewer solver iterations first and re-score only the best ones.")
+    parser.add_argument("--rescore-fraction", type=float, default=0.2,
+                        help="Fraction of the population re-scored at full fidelity after screening.")
+    parser.add_argument("--cars-per-world", type=int, default=1,
+                        help="Cars sharing one world during car evolution, faster but more than 1 makes fitness noisy.")
+    parser.add_argument("--edge-floor", action="store_true",
+                        help="Build the car floor as one body of edges instead of a body per tile.")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="Processes evaluating fights during fighter evolution.")
+    parser.add_argument("--reuse-arenas", action="store_true",
+                        help="Reuse one fight arena per process, faster but results then depend on --workers.")
+    parser.add_argument("--children", type=int, default=10,
+                        help="New genomes per population and generation during fighter evolution.")
+    parser.add_argument("--candidates", type=int, default=None,
+                        help="Children per population that race for the --children places, cheap short fights "
+                             "weed out the weak ones before the full evaluation.")
+    parser.add_argument("--race-steps", type=int, default=None,
+                        help="Steps of the first racing fights, doubled every round, defaults to a quarter of --steps.")
+    parser.add_argument("--warmup-matches", type=int, default=10,
+                        help="Fights per left genome before fighter evolution starts.")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Write a checkpoint after every generation into this directory.")
+    parser.add_argument("--resume", default=None,
+                        help="Continue from a checkpoint, --generations is the total including the restored ones.")
+    parser.add_argument("--profile", default=None, metavar="SINK",
+                        help="Report time per phase and throughput after every generation "
+                             "to stdout or to a .csv or .jsonl file.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    profiler = Profiler([create_sink(args.profile)]) if args.profile is not None else NULL_PROFILER
+    try:
+        if args.mode == "car":
+            run_car_evolution(args, profiler)
+        else:
+            run_fighter_evolution(args, profiler)
+    finally:
+        profiler.close()
+
+if __name__ == "__main__":
+    main()
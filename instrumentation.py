@@ -0,0 +1,176 @@
+"""
+Per-phase timers and throughput counters for the evolution loops.
+Evolvers and renderers take a Profiler, the default NULL_PROFILER does nothing so disabled instrumentation costs
+a method call per phase. Reports go to pluggable sinks: stdout, CSV or JSON lines.
+"""
+import csv
+import json
+import sys
+import time
+
+from collections import defaultdict
+
+# Reported even when unused, so every report has the same fields
+PHASES = ("build", "physics", "rating", "selection", "render", "pool")
+COUNTERS = ("steps", "matches", "genomes")
+
+class _Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.timings[self.name] += time.perf_counter() - self.start
+        return False
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Profiler:
+    """
+    Accumulates the time spent per phase and event counters since the last report.
+
+        with profiler.phase("physics"):
+            world.Step(...)
+        profiler.count("steps")
+    """
+    enabled = True
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.start_time = time.perf_counter()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def record(self, **fields):
+        """
+        Returns the phase times in seconds and the counters per second since the last reset.
+        """
+        elapsed = self.elapsed()
+        record = dict(fields)
+        record["elapsed"] = elapsed
+        for name in [*PHASES, *sorted(set(self.timings) - set(PHASES))]:
+            record[f"{name}_seconds"] = self.timings[name]
+        for name in [*COUNTERS, *sorted(set(self.counters) - set(COUNTERS))]:
+            record[f"{name}_per_second"] = self.counters[name] / elapsed if elapsed > 0 else 0.0
+        return record
+
+    def report(self, **fields):
+        """
+        Writes a record to all sinks and starts a new measurement, fields like the generation are added to the record.
+        """
+        record = self.record(**fields)
+        for sink in self.sinks:
+            sink.write(record)
+        self.reset()
+        return record
+
+    def summary(self):
+        """
+        Returns short text lines for on-screen display.
+        """
+        elapsed = self.elapsed()
+        lines = [f"{name}: {self.counters[name] / elapsed:.0f}/s" for name in COUNTERS if self.counters[name]]
+        lines += [f"{name}: {100 * seconds / elapsed:.0f}%" for name, seconds in sorted(self.timings.items())]
+        return lines
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class NullProfiler(Profiler):
+    """
+    A profiler that measures nothing.
+    """
+    enabled = False
+    _null_phase = _NullPhase()
+
+    def __init__(self):
+        super().__init__()
+
+    def phase(self, name):
+        return self._null_phase
+
+    def count(self, name, n=1):
+        pass
+
+    def report(self, **fields):
+        return None
+
+    def summary(self):
+        return []
+
+NULL_PROFILER = NullProfiler()
+
+class StdoutSink:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, record):
+        fields = ", ".join(f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}"
+                           for key, value in record.items())
+        print(fields, file=self.stream, flush=True)
+
+    def close(self):
+        pass
+
+class CsvSink:
+    """
+    Writes one row per record, the columns are taken from the first record.
+    """
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = None
+
+    def write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(record), extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerow(record)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.file = open(path, "w")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def create_sink(target):
+    """
+    Returns a sink for "stdout" or a path ending in .csv or .jsonl.
+    """
+    if target == "stdout":
+        return StdoutSink()
+    if target.endswith(".csv"):
+        return CsvSink(target)
+    if target.endswith(".jsonl"):
+        return JsonLinesSink(target)
+    raise ValueError(f"Unknown profile sink {target}, use stdout, a .csv or a .jsonl path")
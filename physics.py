@@ -0,0 +1,90 @@
+import numpy as np
+
+class PhysicsSettings:
+    def __init__(self, time_step=1./60, velocity_iterations=10, position_iterations=10,
+                 screening=None, rescore_fraction=0.2, merge_body_fixtures=False):
+        """
+        How a world is stepped, shared by the evolvers and the renderers.
+
+        Parameters
+        ----------
+        time_step : float
+            The simulated seconds per physics step.
+        velocity_iterations : int
+            The velocity iterations of the Box2D constraint solver.
+        position_iterations : int
+            The position iterations of the Box2D constraint solver.
+        screening : PhysicsSettings
+            Optional coarse settings for a first evaluation pass, only the promising genomes are re-scored with these settings.
+            None evaluates everything at full fidelity.
+        rescore_fraction : float
+            The fraction of the population re-scored at full fidelity after a screening pass.
+        merge_body_fixtures : bool
+            Cars are built from the fewest convex polygons instead of a triangle per body vertex.
+            The shape stays the same, but fewer fixtures mean fewer contacts per step.
+        """
+        self.time_step = time_step
+        self.velocity_iterations = velocity_iterations
+        self.position_iterations = position_iterations
+        self.screening = screening
+        self.rescore_fraction = rescore_fraction
+        self.merge_body_fixtures = merge_body_fixtures
+
+    def step(self, world):
+        world.Step(self.time_step, self.velocity_iterations, self.position_iterations)
+
+    def with_screening(self, velocity_iterations=3, position_iterations=2, rescore_fraction=0.2):
+        """
+        Returns a copy of these settings whose screening pass uses fewer solver iterations at the same time step.
+        """
+        screening = PhysicsSettings(self.time_step, velocity_iterations, position_iterations,
+                                    merge_body_fixtures=self.merge_body_fixtures)
+        return PhysicsSettings(self.time_step, self.velocity_iterations, self.position_iterations,
+                               screening=screening, rescore_fraction=rescore_fraction,
+                               merge_body_fixtures=self.merge_body_fixtures)
+
+    def key(self):
+        # Everything that influences a simulation result, used by fitness caches
+        return (self.time_step, self.velocity_iterations, self.position_iterations, self.merge_body_fixtures)
+
+    def __repr__(self):
+        return (f"PhysicsSettings(time_step={self.time_step}, velocity_iterations={self.velocity_iterations}, "
+                f"position_iterations={self.position_iterations}, screening={self.screening!r}, "
+                f"rescore_fraction={self.rescore_fraction}, merge_body_fixtures={self.merge_body_fixtures})")
+
+class WorldRunner:
+    def __init__(self, world, cars, physics: PhysicsSettings):
+        """
+        Advances a world many steps per call. The motors of the cars are started once here,
+        so the step loop does nothing besides stepping and sampling positions.
+
+        Parameters
+        ----------
+        cars : list
+            The cars in the world, their motor speed must not change while running.
+        """
+        self.world = world
+        self.cars = list(cars)
+        self.physics = physics
+        for car in self.cars:
+            car.update()
+
+    def run(self, num_steps, sampled=()):
+        """
+        Steps the world num_steps times.
+        Returns the x positions of the cars with the sampled indices after every step, with shape (num_steps, len(sampled)).
+        """
+        world_step = self.world.Step
+        time_step = self.physics.time_step
+        velocity_iterations = self.physics.velocity_iterations
+        position_iterations = self.physics.position_iterations
+        bodies = [self.cars[i].body for i in sampled]
+        positions = np.empty((num_steps, len(bodies)))
+        for i in range(num_steps):
+            world_step(time_step, velocity_iterations, position_iterations)
+            if bodies:
+                positions[i] = [body.position.x for body in bodies]
+        return positions
+
+CAR_PHYSICS = PhysicsSettings(time_step=2./60)
+FIGHTER_PHYSICS = PhysicsSettings(time_step=1./60)
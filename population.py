@@ -1,9 +1,16 @@
 import numpy as np
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 
 from typing import Callable, TypeVar, List
 Genome = TypeVar("Genome")
 
+def copy_genome(genome):
+    # Genomes providing clone() only copy their genetic parameters, everything else falls back to deepcopy
+    if hasattr(genome, "clone"):
+        return genome.clone()
+    return deepcopy(genome)
+
 class Population:
     def __init__(self,
         population_size: int,
@@ -33,8 +40,8 @@ class Population:
         children = []
         for p1, p2 in zip(parents[:len(parents)//2], parents[len(parents)//2:]):
             # Crossover modifies both genomes, so we have to first copy them
-            c1 = deepcopy(p1)
-            c2 = deepcopy(p2)
+            c1 = copy_genome(p1)
+            c2 = copy_genome(p2)
             c1.crossover(c2)
             children.append(c1)
             children.append(c2)
@@ -48,11 +55,132 @@ class Population:
     def replace_weak_genome(self, new_genome, weak_percentage=0.2):
         self.genomes = sorted(self.genomes, key=lambda x: x.fitness)
         target_index = np.random.randint(0, int(len(self.genomes) * weak_percentage))
+        replaced_genome = self.genomes[target_index]
         self.genomes[target_index] = new_genome
+        return replaced_genome
     
     def randomize(self, population_size):
         self.genomes = [self.genome_fn() for _ in range(population_size)]
         
     def __len__(self):
         return len(self.genomes)
-        
\ No newline at end of file
+        
+
+class RankedPopulation(Population):
+    """
+    A population that keeps its genomes sorted by ascending fitness while they are replaced and re-evaluated.
+    Fitness changes have to go through update_fitness, elite selection and weak genome replacement then no longer sort the whole population.
+    """
+    @property
+    def genomes(self):
+        return self._genomes
+
+    @genomes.setter
+    def genomes(self, genomes):
+        self._genomes = sorted(genomes, key=lambda x: x.fitness)
+        self._keys = [genome.fitness for genome in self._genomes]
+
+    def elite_select(self, num_children: int) -> List[Genome]:
+        return self._genomes[max(0, len(self._genomes) - num_children):][::-1]
+
+    def replace_weak_genome(self, new_genome, weak_percentage=0.2):
+        target_index = np.random.randint(0, int(len(self._genomes) * weak_percentage))
+        replaced_genome = self._pop(target_index)
+        self._insert(new_genome)
+        return replaced_genome
+
+    def update_fitness(self, genome, fitness):
+        """
+        Sets the fitness of a genome and moves it to its new rank, genomes not in the population are only updated.
+        """
+        index = self._index_of(genome)
+        if index is None:
+            genome.fitness = fitness
+            return
+        self._pop(index)
+        genome.fitness = fitness
+        self._insert(genome)
+
+    def _index_of(self, genome):
+        index = bisect_left(self._keys, genome.fitness)
+        end = bisect_right(self._keys, genome.fitness, lo=index)
+        for i in range(index, end):
+            if self._genomes[i] is genome:
+                return i
+        # The fitness was changed behind our back
+        for i, other in enumerate(self._genomes):
+            if other is genome:
+                return i
+        return None
+
+    def _pop(self, index):
+        del self._keys[index]
+        return self._genomes.pop(index)
+
+    def _insert(self, genome):
+        index = bisect_right(self._keys, genome.fitness)
+        self._keys.insert(index, genome.fitness)
+        self._genomes.insert(index, genome)
+
+
+class ArrayPopulation:
+    def __init__(self,
+        population_size: int,
+        arrays_fn
+    ):
+        """
+        Creates a new population whose genomes are stored as rows of shared arrays, see genome_arrays.
+
+        Parameters
+        ----------
+        population_size : int
+            The size of the population.
+        arrays_fn : Callable[int, CarGenomeArrays]
+            A function returning the arrays for the given number of random genomes.
+        """
+        self.arrays_fn = arrays_fn
+        self.randomize(population_size)
+
+    def roulette_wheel_crossover(self, num_children: int) -> List[Genome]:
+        return self._crossover_arrays(num_children).views()
+
+    def elite_select(self, num_children: int) -> List[Genome]:
+        return [self.genomes[i] for i in self._elite_indices(num_children)]
+
+    def next_generation(self, elite_percentage=0.2, mutation_rate=0.1):
+        """
+        Replaces the population by its elites and mutated roulette wheel children, using a few vectorized calls.
+        """
+        elite_indices = self._elite_indices(int(len(self) * elite_percentage))
+        children = self._crossover_arrays(len(self) - len(elite_indices))
+        children.mutate(mutation_rate)
+        arrays = self.arrays.take(elite_indices).concatenate(children)
+        self._set_arrays(arrays.take(np.random.permutation(len(arrays))))
+
+    def randomize(self, population_size):
+        self._set_arrays(self.arrays_fn(population_size))
+
+    def _elite_indices(self, num_children):
+        return np.argsort(-self.arrays.fitness, kind="stable")[:num_children]
+
+    def _crossover_arrays(self, num_children):
+        # Normalize fitness values to probabilities for roulette wheel selection
+        genome_fitness = self.arrays.fitness - self.arrays.fitness.min() # Make everything positive
+        parent_probabilities = genome_fitness / genome_fitness.sum()
+
+        # Same pairing as Population.roulette_wheel_crossover, children of a pair are interleaved
+        num_pairs = (num_children + 1) // 2
+        parents = np.random.choice(len(self), size=num_pairs * 2, p=parent_probabilities)
+        children_a = self.arrays.take(parents[:num_pairs])
+        children_b = self.arrays.take(parents[num_pairs:])
+        children_a.crossover(children_b)
+
+        order = np.arange(num_pairs * 2).reshape(2, num_pairs).T.ravel()
+        return children_a.concatenate(children_b).take(order[:num_children])
+
+    def _set_arrays(self, arrays):
+        self.arrays = arrays
+        self.genomes = arrays.views()
+
+    def __len__(self):
+        return len(self.arrays)
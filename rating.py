@@ -0,0 +1,159 @@
+import math
+import numpy as np
+import trueskill
+
+def erfc(x):
+    """
+    Vectorized complementary error function, the same Chebyshev approximation as the default trueskill backend.
+    """
+    z = np.abs(x)
+    t = 1. / (1. + z / 2.)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    return np.where(x < 0, 2. - r, r)
+
+def cdf(x):
+    return 0.5 * erfc(-x / math.sqrt(2))
+
+def pdf(x):
+    return np.exp(-x ** 2 / 2) / math.sqrt(2 * math.pi)
+
+class TrueSkill1vs1:
+    """
+    Closed form TrueSkill update of 1 vs 1 matches with draws, vectorized over many matches.
+    Gives the same ratings as trueskill.rate_1vs1 with the same environment, up to floating point rounding.
+    """
+    def __init__(self, env=None):
+        self.env = env if env is not None else trueskill.global_env()
+        self.beta = self.env.beta
+        self.tau = self.env.tau
+        self.draw_margin = trueskill.calc_draw_margin(self.env.draw_probability, 2, self.env)
+
+    def rate(self, mu_a, sigma_a, mu_b, sigma_b, drawn):
+        """
+        Rates matches that player a won against player b, or drew if drawn is set.
+        All arguments are arrays of the same length, returns the new (mu_a, sigma_a, mu_b, sigma_b).
+        """
+        # Ratings drift a little before every match
+        variance_a = sigma_a ** 2 + self.tau ** 2
+        variance_b = sigma_b ** 2 + self.tau ** 2
+        c_squared = 2 * self.beta ** 2 + variance_a + variance_b
+        c = np.sqrt(c_squared)
+        t = (mu_a - mu_b) / c
+        epsilon = self.draw_margin / c
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Win
+            x = t - epsilon
+            denominator = cdf(x)
+            v_win = np.where(denominator > 0, pdf(x) / denominator, -x)
+            w_win = v_win * (v_win + x)
+            # Draw
+            a = epsilon - np.abs(t)
+            b = -epsilon - np.abs(t)
+            denominator = cdf(a) - cdf(b)
+            v_draw = np.where(denominator > 0, (pdf(b) - pdf(a)) / denominator, a)
+            w_draw = v_draw ** 2 + (a * pdf(a) - b * pdf(b)) / denominator
+            v_draw = np.where(t < 0, -v_draw, v_draw)
+
+        v = np.where(drawn, v_draw, v_win)
+        w = np.where(drawn, w_draw, w_win)
+        new_mu_a = mu_a + variance_a / c * v
+        new_mu_b = mu_b - variance_b / c * v
+        new_sigma_a = np.sqrt(variance_a * (1 - variance_a / c_squared * w))
+        new_sigma_b = np.sqrt(variance_b * (1 - variance_b / c_squared * w))
+        return new_mu_a, new_sigma_a, new_mu_b, new_sigma_b
+
+def _waves(slots_left, slots_right):
+    # A match can only be rated after the previous matches of both genomes
+    last_wave_left = {}
+    last_wave_right = {}
+    waves = np.empty(len(slots_left), dtype=int)
+    for i, (left, right) in enumerate(zip(slots_left, slots_right)):
+        wave = max(last_wave_left.get(left, -1), last_wave_right.get(right, -1)) + 1
+        last_wave_left[left] = last_wave_right[right] = waves[i] = wave
+    return waves
+
+def rate_matches(engine, ratings_left, ratings_right, matchups, outcomes):
+    """
+    Rates a list of (genome_left, genome_right) matchups in order, as if rate_1vs1 was called for each of them.
+    outcomes holds 1 if the left genome won, -1 if the right genome won and 0 for a draw.
+    All genomes have to be in their rating index. The mu/sigma arrays of both indexes are updated in vectorized waves,
+    in which every genome fights at most once, afterwards the new ratings are written back to the genomes.
+    """
+    slots_left = np.array([ratings_left.slot(left) for left, _ in matchups], dtype=int)
+    slots_right = np.array([ratings_right.slot(right) for _, right in matchups], dtype=int)
+    outcomes = np.asarray(outcomes)
+    waves = _waves(slots_left.tolist(), slots_right.tolist())
+
+    for wave in range(waves.max() + 1 if len(waves) else 0):
+        matches = np.flatnonzero(waves == wave)
+        left, right = slots_left[matches], slots_right[matches]
+        right_won = outcomes[matches] < 0
+        # The winner is player a, draws keep the left genome as player a
+        mu_left, sigma_left = ratings_left.mu[left], ratings_left.sigma[left]
+        mu_right, sigma_right = ratings_right.mu[right], ratings_right.sigma[right]
+        mu_a, sigma_a, mu_b, sigma_b = engine.rate(
+            np.where(right_won, mu_right, mu_left), np.where(right_won, sigma_right, sigma_left),
+            np.where(right_won, mu_left, mu_right), np.where(right_won, sigma_left, sigma_right),
+            outcomes[matches] == 0
+        )
+        ratings_left.mu[left] = np.where(right_won, mu_b, mu_a)
+        ratings_left.sigma[left] = np.where(right_won, sigma_b, sigma_a)
+        ratings_right.mu[right] = np.where(right_won, mu_a, mu_b)
+        ratings_right.sigma[right] = np.where(right_won, sigma_a, sigma_b)
+
+    for ratings, slots in ((ratings_left, slots_left), (ratings_right, slots_right)):
+        for slot in np.unique(slots).tolist():
+            genome = ratings.genomes[slot]
+            genome.rating = trueskill.Rating(ratings.mu[slot].item(), ratings.sigma[slot].item())
+            # Rating stores precision values, keep the index equal to what it reports
+            ratings.update(genome)
+
+class RatingIndex:
+    """
+    Keeps the TrueSkill ratings of a population in mu/sigma arrays.
+    Finding the fairest opponent is a single vectorized match quality computation instead of a quality_1vs1 call per genome.
+    The index has to be told about rating changes (update) and replaced genomes (replace).
+    """
+    def __init__(self, genomes, env=None):
+        self.env = env if env is not None else trueskill.global_env()
+        self.genomes = list(genomes)
+        self._slots = {id(genome): slot for slot, genome in enumerate(self.genomes)}
+        self.mu = np.array([genome.rating.mu for genome in self.genomes], dtype=float)
+        self.sigma = np.array([genome.rating.sigma for genome in self.genomes], dtype=float)
+
+    def update(self, genome):
+        slot = self._slots.get(id(genome))
+        if slot is None:
+            return
+        self.mu[slot] = genome.rating.mu
+        self.sigma[slot] = genome.rating.sigma
+
+    def slot(self, genome):
+        return self._slots[id(genome)]
+
+    def replace(self, old_genome, new_genome):
+        slot = self._slots.pop(id(old_genome))
+        self.genomes[slot] = new_genome
+        self._slots[id(new_genome)] = slot
+        self.update(new_genome)
+
+    def quality(self, rating):
+        """
+        Returns the match quality between rating and every indexed genome, equal to trueskill.quality_1vs1.
+        """
+        two_beta_sq = 2 * self.env.beta ** 2
+        variance = two_beta_sq + rating.sigma ** 2 + self.sigma ** 2
+        return np.sqrt(two_beta_sq / variance) * np.exp(-(rating.mu - self.mu) ** 2 / (2 * variance))
+
+    def best_opponent(self, rating):
+        return self.genomes[int(np.argmax(self.quality(rating)))]
+
+    def __len__(self):
+        return len(self.genomes)
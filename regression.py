@@ -0,0 +1,117 @@
+"""
+Checks that optimized code paths still give the results of the straightforward code they replaced, with fixed seeds.
+
+    python regression.py
+    python regression.py --only rating
+
+Every check prints the largest deviation it found, the exit code is 1 if one of them exceeds its tolerance.
+"""
+import argparse
+import sys
+import numpy as np
+import trueskill
+
+from types import SimpleNamespace
+from Box2D import b2World
+from genomes import CarGenome, FighterGenome
+from rating import TrueSkill1vs1, RatingIndex, rate_matches
+
+SEED = 1
+
+def check_rating_engine(num_matches=2000):
+    """
+    Compares TrueSkill1vs1 against trueskill.rate_1vs1 on random ratings, including lopsided ones.
+    """
+    rng = np.random.default_rng(SEED)
+    mu = rng.uniform(-20, 70, size=(num_matches, 2))
+    sigma = rng.uniform(0.5, 10, size=(num_matches, 2))
+    drawn = rng.random(num_matches) < 0.3
+    new_ratings = np.column_stack(TrueSkill1vs1().rate(mu[:, 0], sigma[:, 0], mu[:, 1], sigma[:, 1], drawn))
+
+    expected = np.empty_like(new_ratings)
+    for i in range(num_matches):
+        a, b = trueskill.rate_1vs1(trueskill.Rating(mu[i, 0], sigma[i, 0]), trueskill.Rating(mu[i, 1], sigma[i, 1]),
+                                   drawn=bool(drawn[i]))
+        expected[i] = (a.mu, a.sigma, b.mu, b.sigma)
+    return np.abs(new_ratings - expected).max()
+
+def check_rate_matches(population_size=20, num_matches=500):
+    """
+    Compares rate_matches against calling trueskill.rate_1vs1 for one match after the other.
+    """
+    rng = np.random.default_rng(SEED)
+    sequential = [[SimpleNamespace(rating=trueskill.Rating()) for _ in range(population_size)] for _ in range(2)]
+    batched = [[SimpleNamespace(rating=trueskill.Rating()) for _ in range(population_size)] for _ in range(2)]
+    pairs = rng.integers(0, population_size, size=(num_matches, 2)).tolist()
+    outcomes = rng.choice([1, -1, 0], size=num_matches).tolist()
+
+    left, right = sequential
+    for (i, j), outcome in zip(pairs, outcomes):
+        if outcome < 0:
+            right[j].rating, left[i].rating = trueskill.rate_1vs1(right[j].rating, left[i].rating)
+        else:
+            left[i].rating, right[j].rating = trueskill.rate_1vs1(left[i].rating, right[j].rating, drawn=outcome == 0)
+
+    left, right = batched
+    rate_matches(TrueSkill1vs1(), RatingIndex(left), RatingIndex(right),
+                 [(left[i], right[j]) for i, j in pairs], outcomes)
+
+    deviation = 0
+    for expected, genomes in zip(sequential, batched):
+        for a, b in zip(expected, genomes):
+            deviation = max(deviation, abs(a.rating.mu - b.rating.mu), abs(a.rating.sigma - b.rating.sigma))
+    return deviation
+
+def check_merged_bodies(num_genomes=500):
+    """
+    Compares the mass, center and inertia of car bodies built from merged convex polygons and from one triangle per vertex.
+    Returns the largest relative deviation, Box2D computes mass data in single precision.
+    """
+    np.random.seed(SEED)
+    deviation = 0
+    for i in range(num_genomes):
+        genome = (CarGenome if i % 2 == 0 else FighterGenome)(body_vertices=10)
+        for is_flipped in (False, True):
+            world = b2World()
+            triangles = genome.create_car(world, (0, 0), is_flipped=is_flipped).body
+            merged = genome.create_car(world, (0, 0), is_flipped=is_flipped, merge_fixtures=True).body
+            deviation = max(deviation,
+                            abs(merged.mass - triangles.mass) / triangles.mass,
+                            abs(merged.inertia - triangles.inertia) / triangles.inertia,
+                            (merged.localCenter - triangles.localCenter).length / np.max(genome.magnitudes))
+    return deviation
+
+def checks():
+    """
+    Returns a list of (name, check, tolerance).
+    """
+    return [
+        ("rating/engine", check_rating_engine, 1e-9),
+        ("rating/rate_matches", check_rate_matches, 1e-9),
+        ("genomes/merged_bodies", check_merged_bodies, 1e-5),
+    ]
+
+def run_checks(only=None):
+    failed = []
+    for name, check, tolerance in checks():
+        if only is not None and not any(name.startswith(prefix) for prefix in only):
+            continue
+        deviation = check()
+        marker = ""
+        if not deviation <= tolerance:
+            failed.append(name)
+            marker = "  FAILED"
+        print(f"{name:40s} {deviation:12.3g} (tolerance {tolerance:g}){marker}", flush=True)
+    return failed
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare optimized code paths against their reference results.")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run checks whose name starts with these.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    return 1 if run_checks(args.only) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
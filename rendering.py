@@ -0,0 +1,85 @@
+"""
+Draws cars with pygame, kept apart from phenomes.py so simulating cars never imports pygame.
+"""
+import math
+import numpy as np
+import pygame
+
+from pygame import Vector2
+from constants import PPM
+from genomes import cross_2d
+
+# BODY_COLOR = pygame.Color("#238fbb")
+# BODY_COLOR = pygame.Color(30, 30, 255, 255)
+BODY_LINE_COLOR = pygame.Color("#1c7296")
+# WHEEL_COLOR = pygame.Color("#e28743")
+WHEEL_LINE_COLOR = pygame.Color(0, 0, 0, 255)
+
+class CarSprite:
+    """
+    Everything needed to draw a car that does not change while it drives, computed on its first render.
+    """
+    def __init__(self, car):
+        self.outline = np.array(car.outline, dtype=float) if car.outline is not None else None
+        # A body whose fan triangles overlap is not filled correctly as one polygon, it is drawn triangle by triangle
+        self.folded = False
+        if self.outline is not None:
+            crosses = cross_2d(self.outline, np.roll(self.outline, -1, axis=0))
+            self.folded = not (np.all(crosses > 0) or np.all(crosses < 0))
+        self.body_color = pygame.Color(30, 30, 230 - int(car.body_density * 200), 255)
+        self.wheel_color = pygame.Color(255 - int(car.wheel_density * 200),
+                                        255 - int(car.wheel_density * 200),
+                                        0, 255)
+        self.wheel_radii = [wheel.fixtures[0].shape.radius for wheel in car.wheels]
+        
+        # Distance from the body center that no part of the car exceeds
+        self.bounding_radius = 0
+        for fixture in car.body.fixtures:
+            for v in fixture.shape.vertices:
+                self.bounding_radius = max(self.bounding_radius, math.hypot(*v))
+        for wheel, wheel_radius in zip(car.wheels, self.wheel_radii):
+            anchor = car.body.GetLocalPoint(wheel.position)
+            self.bounding_radius = max(self.bounding_radius, anchor.length + wheel_radius)
+
+def render_car(car, game):
+    sprite = getattr(car, "sprite", None)
+    if sprite is None:
+        sprite = car.sprite = CarSprite(car)
+    # Skip cars outside of the screen
+    if not game.is_visible(car.body.position * PPM, sprite.bounding_radius * PPM):
+        return
+    _render_body(car, sprite, game)
+    _render_wheels(car, sprite, game)
+
+def _render_body(car, sprite, game):
+    body = car.body
+    position = body.position
+    center = (position.x * PPM, position.y * PPM)
+    if sprite.outline is None:
+        polygons = [[(body.transform * v) * PPM for v in fixture.shape.vertices]
+                    for fixture in body.fixtures]
+        vertices = [v for polygon in polygons for v in polygon]
+    else:
+        # Transform all vertices at once
+        c, s = math.cos(body.angle), math.sin(body.angle)
+        vertices = (sprite.outline @ np.array([[c, s], [-s, c]]) * PPM + center).tolist()
+        if sprite.folded:
+            polygons = [[v, vertices[(i + 1) % len(vertices)], center] for i, v in enumerate(vertices)]
+        else:
+            polygons = [vertices]
+    
+    for polygon in polygons:
+        game.draw_polygon(sprite.body_color, polygon)
+    # All spokes are a single line strip going back and forth through the center
+    spokes = [center]
+    for v in vertices:
+        spokes += [v, center]
+    game.draw_lines(BODY_LINE_COLOR, spokes, width=2)
+
+def _render_wheels(car, sprite, game):
+    for wheel, radius in zip(car.wheels, sprite.wheel_radii):
+        center = wheel.position * PPM
+        radius = int(radius * PPM)
+        dir_vec = Vector2(0, radius).rotate(math.degrees(wheel.angle))
+        game.draw_circle(sprite.wheel_color, center, radius)
+        game.draw_line(WHEEL_LINE_COLOR, center, center + dir_vec, width=2)